@@ -7,20 +7,11 @@ import face_recognition
 import os
 import sqlite3
 import datetime
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.image import MIMEImage
-from email.header import Header
-import pygame
-import threading
-import time
 import logging
 import json
-import queue
 import shutil
-from collections import deque
-from math import hypot
+from ebi_engine import DETECTIONS_DB_FILE, EBIEngine
+from ebi_liveness import BlinkMonitor
 
 # Configuración de logging
 logging.basicConfig(
@@ -32,80 +23,13 @@ logging.basicConfig(
     ]
 )
 
-# Configuración global
-DB_FILE = './ebi_database.db'
-DETECTIONS_DB_FILE = './detections_database.db'
-ALARM_SOUND = 'alarm.wav'  # Archivo de sonido de alarma
+# Configuración global (la de detección, base y alertas está en ebi_engine)
 APP_TITLE = "EBI - Escáner Biométrico Inteligente"
 TEMP_IMAGE_DIR = './temp_images'
 
-# Configuración para enviar correos (modificar con tus datos)
-EMAIL_CONFIG = {
-    'smtp_server': 'smtp.gmail.com',
-    'smtp_port': 587,
-    'email': 'brianbagnato2023@gmail.com',
-    'password': 'opmt nees umbw tfgd',
-    'recipient': 'bgmbagnato@itel.edu.ar'
-}
-
 # Crear directorios necesarios
 os.makedirs(TEMP_IMAGE_DIR, exist_ok=True)
 
-# Crear la base de datos de personas (autorizadas e intrusos)
-def create_database():
-    try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS personas
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                     nombre TEXT,
-                     dni TEXT,
-                     descripcion TEXT,
-                     autorizado INTEGER DEFAULT 0,
-                     foto_blob BLOB NOT NULL,
-                     encoding BLOB NOT NULL,
-                     fecha_carga TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-        conn.commit()
-        conn.close()
-        logging.info("Base de datos de personas creada/verificada correctamente")
-    except Exception as e:
-        logging.error(f"Error al crear la base de datos de personas: {e}")
-
-# Crear la base de datos de detecciones
-def create_detections_database():
-    try:
-        conn = sqlite3.connect(DETECTIONS_DB_FILE)
-        c = conn.cursor()
-        
-        # Primero, verificar si la tabla existe
-        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='detecciones'")
-        table_exists = c.fetchone()
-        
-        if table_exists:
-            # Verificar si la columna 'autorizado' existe
-            c.execute("PRAGMA table_info(detecciones)")
-            columns = [column[1] for column in c.fetchall()]
-            if 'autorizado' not in columns:
-                c.execute("ALTER TABLE detecciones ADD COLUMN autorizado INTEGER")
-        else:
-            # Crear la tabla si no existe
-            c.execute('''CREATE TABLE IF NOT EXISTS detecciones
-                         (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                         persona_id INTEGER,
-                         nombre TEXT,
-                         dni TEXT,
-                         autorizado INTEGER,
-                         fecha_deteccion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                         foto_blob BLOB,
-                         ubicacion TEXT DEFAULT 'Desconocida',
-                         FOREIGN KEY (persona_id) REFERENCES personas (id))''')
-        
-        conn.commit()
-        conn.close()
-        logging.info("Base de datos de detecciones creada/verificada correctamente")
-    except Exception as e:
-        logging.error(f"Error al crear la base de datos de detecciones: {e}")
-
 # Limpiar directorio temporal
 def clean_temp_directory():
     try:
@@ -121,63 +45,10 @@ def clean_temp_directory():
     except Exception as e:
         logging.error(f"Error al limpiar directorio temporal: {e}")
 
-# ----------------- Funciones para EAR (detectar parpadeo) -----------------
-def eye_aspect_ratio(eye):
-    """
-    eye: lista de puntos (x,y) del ojo en el orden que devuelve face_recognition
-    Calcula la relación A+B / (2*C)
-    """
-    A = hypot(eye[1][0] - eye[5][0], eye[1][1] - eye[5][1])
-    B = hypot(eye[2][0] - eye[4][0], eye[2][1] - eye[4][1])
-    C = hypot(eye[0][0] - eye[3][0], eye[0][1] - eye[3][1])
-    if C == 0:
-        return 0.0
-    return (A + B) / (2.0 * C)
-
-def detect_blink_in_frames(frames, ear_threshold=0.23, consec_frames_for_blink=2):
-    """
-    frames: lista de frames BGR (numpy arrays), se analiza cada frame buscando eyes landmarks
-    Devuelve True si encuentra al menos un parpadeo.
-    """
-    blink_count = 0
-    consec = 0
-
-    for f in frames:
-        try:
-            small = cv2.resize(f, (0, 0), fx=0.5, fy=0.5)  # reducir para velocidad
-            rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
-            landmarks_list = face_recognition.face_landmarks(rgb)
-            if not landmarks_list:
-                consec = 0
-                continue
-            lm = landmarks_list[0]  # tomamos la primera cara
-            left = lm.get('left_eye')
-            right = lm.get('right_eye')
-            if left and right and len(left) >= 6 and len(right) >= 6:
-                leftEAR = eye_aspect_ratio(left)
-                rightEAR = eye_aspect_ratio(right)
-                ear = (leftEAR + rightEAR) / 2.0
-                if ear < ear_threshold:
-                    consec += 1
-                else:
-                    if consec >= consec_frames_for_blink:
-                        blink_count += 1
-                    consec = 0
-        except Exception:
-            # si falla un frame, lo ignoramos
-            consec = 0
-            continue
-
-    # Si quedó un parpadeo al final del buffer:
-    if consec >= consec_frames_for_blink:
-        blink_count += 1
-
-    return blink_count >= 1
-# -----------------------------------------------------------------------
 
 # Clase principal de la aplicación
 class EBIApp:
-    def __init__(self, root):
+    def __init__(self, root, engine=None):
         self.root = root
         self.root.title(APP_TITLE)
         self.root.geometry("1000x700")
@@ -187,33 +58,15 @@ class EBIApp:
         # Limpiar directorio temporal al iniciar
         clean_temp_directory()
         
-        # Variables de estado
-        self.camera_active = False
-        self.detection_active = False
-        self.cap = None
+        # Cámaras, galería, detección, base y alertas viven en el motor;
+        # la aplicación solo agrega la vista previa y las pantallas
+        self.engine = engine or EBIEngine()
+        self.camera = None  # CameraReader de la cámara en vista previa
+        self.preview_seq = -1  # Último frame mostrado en la vista previa
         self.current_frame = None
-        self.known_face_encodings = []
-        self.known_face_data = []
-        self.detection_thread = None
-        self.stop_detection_flag = threading.Event()
-        self.frame_queue = queue.Queue(maxsize=1)
-        self.last_detection_time = {}
-        self.detection_cooldown = 3  # Segundos entre detecciones del mismo intruso
-        self.camera_available = True  # Asumimos que hay cámara disponible inicialmente
-        
-        # Inicializar pygame para sonido
-        try:
-            pygame.mixer.init()
-            logging.info("Mixer de pygame inicializado correctamente")
-        except Exception as e:
-            logging.error(f"Error al inicializar pygame mixer: {e}")
-        
-        # Crear bases de datos si no existen
-        create_database()
-        create_detections_database()
         
         # Cargar personas existentes
-        self.load_personas()
+        self.engine.load_personas()
         
         # Crear el contenedor principal con mejor responsividad
         self.container = tk.Frame(root, bg='#2c3e50')
@@ -237,6 +90,27 @@ class EBIApp:
         # Configurar evento para redimensionamiento
         self.root.bind('<Configure>', self.on_resize)
     
+    # Estado del motor, con los nombres que usan las pantallas
+    @property
+    def camera_active(self):
+        return self.engine.camera_active
+    
+    @property
+    def camera_available(self):
+        return self.engine.camera_available
+    
+    @property
+    def detection_active(self):
+        return self.engine.detection_active
+    
+    @property
+    def cameras(self):
+        return self.engine.cameras
+    
+    @property
+    def preview_camera(self):
+        return self.engine.preview_camera
+    
     def on_resize(self, event):
         """Manejar redimensionamiento de la ventana para responsividad"""
         if hasattr(self, 'current_frame') and self.current_frame:
@@ -245,8 +119,8 @@ class EBIApp:
     
     def on_closing(self):
         """Manejar el cierre de la aplicación de forma limpia"""
-        self.stop_detection()
-        self.stop_camera()
+        self.camera = None
+        self.engine.shutdown()
         clean_temp_directory()
         self.root.destroy()
     
@@ -270,51 +144,50 @@ class EBIApp:
             self.start_detection()
     
     def start_camera(self):
-        if not self.camera_active:
-            try:
-                self.cap = cv2.VideoCapture(0)
-                if not self.cap.isOpened():
-                    self.camera_available = False
-                    logging.warning("No se pudo abrir la cámara")
-                    return False
-                
-                # Configurar resolución para mejor rendimiento
-                self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-                self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-                self.cap.set(cv2.CAP_PROP_FPS, 30)
-                
-                self.camera_active = True
-                self.camera_available = True
-                self.update_camera()
-                logging.info("Cámara iniciada correctamente")
-                return True
-            except Exception as e:
-                self.camera_available = False
-                logging.error(f"Error al iniciar la cámara: {e}")
+        if self.camera is None:
+            if not self.engine.start_camera():
                 return False
+            self.camera = self.preview_camera.reader
+            self.preview_seq = -1
+            self.update_camera()
         return True
     
     def stop_camera(self):
-        if self.camera_active:
-            self.camera_active = False
-            if self.cap:
-                self.cap.release()
-                self.cap = None
-            logging.info("Cámara detenida")
+        self.camera = None
+        self.engine.stop_camera()
+    
+    def set_preview_camera(self, index):
+        """Cambiar la cámara que se muestra en pantalla"""
+        if self.engine.set_preview_camera(index):
+            self.camera = self.preview_camera.reader
+            self.preview_seq = -1
+    
+    def start_detection(self):
+        # Abrir la vista previa si la detección tiene que iniciar las cámaras
+        if not self.start_camera():
+            return False
+        return self.engine.start_detection()
+    
+    def stop_detection(self):
+        self.engine.stop_detection()
+    
+    def pipeline_status(self):
+        return self.engine.pipeline_status()
     
     def update_camera(self):
         # Solo actualizar si estamos en el frame correcto y la cámara está activa
-        if self.camera_active and self.cap is not None and isinstance(self.current_frame, (BuscarIntrusoFrame, CargarPersonaFrame)):
+        if self.camera_active and self.camera is not None and isinstance(self.current_frame, (BuscarIntrusoFrame, CargarPersonaFrame)):
             try:
-                ret, frame = self.cap.read()
-                if ret:
-                    # Si el frame actual tiene buffer de frames, guardamos una copia (para detectar parpadeo)
+                # Mostrar el último frame publicado por el hilo de captura, si es nuevo
+                seq, timestamp, frame = self.camera.ring.latest()
+                if seq > self.preview_seq:
+                    self.preview_seq = seq
+                    # Durante la cuenta regresiva cada frame nuevo alimenta la detección de parpadeo
                     try:
-                        if hasattr(self.current_frame, 'collect_frames') and self.current_frame.collect_frames:
-                            # guardamos una copia reducida para ahorrar memoria
-                            self.current_frame.recent_frames.append(frame.copy())
+                        if getattr(self.current_frame, 'collect_frames', False):
+                            self.current_frame.blink_monitor.feed(frame)
                     except Exception as e:
-                        logging.error(f"Error al guardar frame: {e}")
+                        logging.error(f"Error al analizar parpadeo: {e}")
 
                     # Reducir la resolución para mostrar (preview)
                     frame_disp = cv2.resize(frame, (320, 240))
@@ -326,40 +199,11 @@ class EBIApp:
                         self.current_frame.camera_label.imgtk = imgtk
                         self.current_frame.camera_label.configure(image=imgtk)
 
-                    self.root.after(30, self.update_camera)  # Reducir a 30ms
-                else:
-                    self.root.after(100, self.update_camera)
+                self.root.after(30, self.update_camera)  # Reducir a 30ms
             except Exception as e:
                 logging.error(f"Error en update_camera: {e}")
                 self.root.after(100, self.update_camera)
     
-    def load_personas(self):
-        try:
-            conn = sqlite3.connect(DB_FILE)
-            c = conn.cursor()
-            c.execute("SELECT id, nombre, dni, descripcion, encoding, autorizado FROM personas")
-            rows = c.fetchall()
-            
-            self.known_face_encodings = []
-            self.known_face_data = []
-            
-            for row in rows:
-                id_val, nombre, dni, desc, encoding_blob, autorizado = row
-                encoding = np.frombuffer(encoding_blob, dtype=np.float64)
-                self.known_face_encodings.append(encoding)
-                self.known_face_data.append({
-                    'id': id_val,
-                    'nombre': nombre,
-                    'dni': dni,
-                    'desc': desc,
-                    'autorizado': autorizado
-                })
-            
-            conn.close()
-            logging.info(f"Personas cargadas: {len(self.known_face_data)}")
-        except Exception as e:
-            logging.error(f"Error al cargar personas: {e}")
-    
     def save_persona(self, nombre, dni, desc, foto_path, autorizado):
         try:
             # Cargar la imagen y obtener el encoding facial
@@ -372,244 +216,27 @@ class EBIApp:
             
             face_encoding = face_encodings[0]
             
+            # Si ya existe una persona con el mismo DNI, ofrecer agregar la foto
+            # como otra plantilla suya en lugar de duplicar la persona
+            if dni:
+                existing = self.engine.find_persona_by_dni(dni)
+                if existing and messagebox.askyesno("Persona existente",
+                        f"Ya existe {existing[1]} con DNI {dni}.\n¿Agregar esta foto como nueva plantilla de esa persona?"):
+                    self.engine.add_template(existing[0], face_encoding)
+                    logging.info(f"Plantilla agregada a: {existing[1]}")
+                    return True
+            
             # Leer la imagen como bytes para almacenar como BLOB
             with open(foto_path, 'rb') as f:
                 foto_blob = f.read()
             
-            # Guardar en la base de datos
-            conn = sqlite3.connect(DB_FILE)
-            c = conn.cursor()
-            c.execute("INSERT INTO personas (nombre, dni, descripcion, autorizado, foto_blob, encoding) VALUES (?, ?, ?, ?, ?, ?)",
-                      (nombre, dni, desc, autorizado, foto_blob, face_encoding.tobytes()))
-            conn.commit()
-            conn.close()
-            
-            # Actualizar la lista de personas en memoria
-            self.load_personas()
+            self.engine.add_persona(nombre, dni, desc, foto_blob, face_encoding, autorizado)
             logging.info(f"Persona guardada: {nombre} - Autorizado: {autorizado}")
             return True
         except Exception as e:
             logging.error(f"Error al guardar persona: {e}")
             messagebox.showerror("Error", f"No se pudo guardar la persona: {e}")
             return False
-    
-    def start_detection(self):
-        if not self.camera_active:
-            if not self.start_camera():
-                return False
-        
-        self.detection_active = True
-        self.stop_detection_flag.clear()
-        
-        # Iniciar hilo de detección
-        self.detection_thread = threading.Thread(target=self.detection_loop, daemon=True)
-        self.detection_thread.start()
-        
-        logging.info("Detección iniciada")
-        return True
-    
-    def stop_detection(self):
-        self.detection_active = False
-        self.stop_detection_flag.set()
-        if self.detection_thread and self.detection_thread.is_alive():
-            self.detection_thread.join(timeout=1.0)
-        logging.info("Detección detenida")
-    
-    def detection_loop(self):
-        detection_interval = 0.5  # Segundos entre detecciones
-        last_detection_time = 0
-        
-        while self.detection_active and not self.stop_detection_flag.is_set():
-            current_time = time.time()
-            
-            # Realizar detección solo si ha pasado el intervalo
-            if current_time - last_detection_time >= detection_interval:
-                self.detect_faces()
-                last_detection_time = current_time
-            
-            time.sleep(0.1)  # Pequeña pausa para no saturar la CPU
-    
-    def detect_faces(self):
-        if not self.camera_active or self.cap is None:
-            return
-        
-        try:
-            ret, frame = self.cap.read()
-            if ret:
-                # Reducir tamaño para mejor rendimiento
-                small_frame = cv2.resize(frame, (0, 0), fx=0.5, fy=0.5)
-                rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-                
-                # Detectar rostros
-                face_locations = face_recognition.face_locations(rgb_small_frame)
-                face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
-                
-                # Si no hay rostros conocidos, saltar detección
-                if not self.known_face_encodings:
-                    return
-                
-                # Comparar con rostros conocidos
-                for face_encoding in face_encodings:
-                    matches = face_recognition.compare_faces(self.known_face_encodings, face_encoding, tolerance=0.5)
-                    
-                    if True in matches:
-                        first_match_index = matches.index(True)
-                        face_data = self.known_face_data[first_match_index]
-                        
-                        # Verificar cooldown para evitar detecciones repetidas
-                        current_time = time.time()
-                        last_detection = self.last_detection_time.get(face_data['id'], 0)
-                        
-                        if current_time - last_detection < self.detection_cooldown:
-                            continue  # Saltar detección si está en cooldown
-                        
-                        # Actualizar tiempo de última detección
-                        self.last_detection_time[face_data['id']] = current_time
-                        
-                        # Guardar detección en base de datos
-                        self.save_detection(face_data, frame)
-                        
-                        # Activar alarma solo si es un intruso (no autorizado)
-                        if not face_data['autorizado']:
-                            threading.Thread(target=self.trigger_alarm, args=(face_data, frame.copy()), daemon=True).start()
-                    else:
-                        # Rostro desconocido - tratar como intruso
-                        unknown_face_data = {
-                            'id': -1,
-                            'nombre': 'DESCONOCIDO',
-                            'dni': 'N/A',
-                            'desc': 'Persona no registrada en el sistema',
-                            'autorizado': 0
-                        }
-                        
-                        # Verificar cooldown para rostros desconocidos
-                        current_time = time.time()
-                        last_detection = self.last_detection_time.get('unknown', 0)
-                        
-                        if current_time - last_detection < self.detection_cooldown:
-                            continue
-                            
-                        self.last_detection_time['unknown'] = current_time
-                        self.save_detection(unknown_face_data, frame)
-                        threading.Thread(target=self.trigger_alarm, args=(unknown_face_data, frame.copy()), daemon=True).start()
-        except Exception as e:
-            logging.error(f"Error en detección de rostros: {e}")
-    
-    def save_detection(self, face_data, frame):
-        try:
-            # Convertir frame a bytes para almacenar como BLOB
-            success, encoded_image = cv2.imencode('.jpg', frame)
-            if not success:
-                logging.error("Error al codificar la imagen para la detección")
-                return
-            
-            image_bytes = encoded_image.tobytes()
-            
-            # Guardar en base de datos
-            conn = sqlite3.connect(DETECTIONS_DB_FILE)
-            c = conn.cursor()
-            c.execute("INSERT INTO detecciones (persona_id, nombre, dni, autorizado, foto_blob) VALUES (?, ?, ?, ?, ?)",
-                      (face_data['id'], face_data['nombre'], face_data['dni'], face_data['autorizado'], image_bytes))
-            conn.commit()
-            conn.close()
-            
-            logging.info(f"Detección guardada: {face_data['nombre']}")
-        except Exception as e:
-            logging.error(f"Error al guardar detección: {e}")
-    
-    def trigger_alarm(self, face_data, frame):
-        try:
-            # Reproducir sonido de alarma
-            if os.path.exists(ALARM_SOUND):
-                try:
-                    sound = pygame.mixer.Sound(ALARM_SOUND)
-                    sound.play()
-                except: 
-                    pass  # Silenciar errores de sonido para no bloquear la app
-        except:
-            pass
-        
-        # Enviar alerta por correo en segundo plano
-        threading.Thread(target=self.send_alert, args=(face_data, frame.copy()), daemon=True).start()
-    
-    def send_alert(self, face_data, frame):
-        # Guardar imagen temporal para el email
-        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-        temp_img_path = os.path.join(TEMP_IMAGE_DIR, f"temp_detection_{timestamp}.jpg")
-        cv2.imwrite(temp_img_path, frame)
-        
-        # Enviar por email
-        self.send_email_alert(face_data, temp_img_path)
-        
-        # Programar eliminación de imagen temporal después de un tiempo
-        self.root.after(10000, lambda: self.cleanup_temp_image(temp_img_path))
-    
-    def cleanup_temp_image(self, img_path):
-        """Eliminar imagen temporal de forma segura"""
-        try:
-            if os.path.exists(img_path):
-                os.remove(img_path)
-                logging.info(f"Imagen temporal eliminada: {img_path}")
-        except Exception as e:
-            logging.error(f"Error al eliminar imagen temporal: {e}")
-    
-    def send_email_alert(self, face_data, img_path):
-        try:
-            msg = MIMEPart()
-            msg['From'] = EMAIL_CONFIG['email']
-            msg['To'] = EMAIL_CONFIG['recipient']
-            
-            # Codificación robusta para caracteres especiales
-            subject = "Alerta de intruso detectado!"
-            msg['Subject'] = Header(subject, 'utf-8')
-            
-            # Crear cuerpo del mensaje con encoding seguro
-            body_content = {
-                'nombre': face_data['nombre'] or 'Desconocido',
-                'dni': face_data['dni'] or 'No disponible',
-                'desc': face_data['desc'] or 'Sin descripción',
-                'fecha': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'ubicacion': 'Ubicación no especificada'
-            }
-            
-            # Usar una plantilla detallada
-            body = f"""
-            ALERTA DE INTRUSO DETECTADO - SISTEMA EBI
-            
-            INFORMACIÓN DEL INTRUSO:
-            • Nombre: {body_content['nombre']}
-            • DNI: {body_content['dni']}
-            • Descripción: {body_content['desc']}
-            
-            INFORMACIÓN DE LA DETECCIÓN:
-            • Fecha y Hora: {body_content['fecha']}
-            • Ubicación: {body_content['ubicacion']}
-            • Sistema: EBI - Escáner Biométrico Inteligente
-            
-            Se ha detectado a esta persona en las inmediaciones. Por favor, verificar.
-            """
-            
-            msg.attach(MIMEText(body, 'plain', 'utf-8'))
-            
-            # Adjuntar imagen
-            with open(img_path, 'rb') as f:
-                img_data = f.read()
-            
-            img = MIMEImage(img_data)
-            img.add_header('Content-Disposition', 'attachment', filename='detection.jpg')
-            msg.attach(img)
-            
-            # Enviar correo
-            server = smtplib.SMTP(EMAIL_CONFIG['smtp_server'], EMAIL_CONFIG['smtp_port'])
-            server.starttls()
-            server.login(EMAIL_CONFIG['email'], EMAIL_CONFIG['password'])
-            server.send_message(msg)
-            server.quit()
-            
-            logging.info(f"Email de alerta enviado para: {face_data['nombre']}")
-            
-        except Exception as e:
-            logging.error(f"Error al enviar correo: {str(e)}")
 
 # Frame de inicio
 class StartFrame(tk.Frame):
@@ -665,9 +292,9 @@ class CargarPersonaFrame(tk.Frame):
         self.configure(bg='#2c3e50')
         self.photo_path = None
         self.preview_img = None
-        # BUFFER para los últimos frames (se usa para detectar parpadeo)
+        # Detección de parpadeo mientras corre la cuenta regresiva
         self.collect_frames = False
-        self.recent_frames = deque(maxlen=60)  # almacena ~60 frames (2 sec aprox a 30fps)
+        self.blink_monitor = None
         self.capture_countdown = None
         self.countdown_remaining = 0
 
@@ -795,12 +422,19 @@ class CargarPersonaFrame(tk.Frame):
             self.controller.root.after_cancel(self.capture_countdown)
             
         # Al volver, detener la cámara si está activa y limpiar flags
-        self.collect_frames = False
-        self.recent_frames.clear()
+        self.stop_blink_monitor()
         if self.controller.camera_active:
             self.controller.stop_camera()
         self.controller.show_frame(StartFrame)
 
+    def stop_blink_monitor(self):
+        """Deja de analizar parpadeo; devuelve (frames con cara, hubo parpadeo)"""
+        self.collect_frames = False
+        monitor, self.blink_monitor = self.blink_monitor, None
+        if monitor is None:
+            return 0, False
+        return monitor.stop()
+
     def start_capture_process(self):
         """
         Inicia el proceso de captura de foto con cuenta regresiva
@@ -812,8 +446,11 @@ class CargarPersonaFrame(tk.Frame):
                 self.show_camera_error()
                 return
 
-        # Limpiar buffer y habilitar recolección
-        self.recent_frames.clear()
+        # Analizar el parpadeo frame a frame desde ya: el veredicto está listo al terminar la cuenta
+        self.stop_blink_monitor()
+        self.blink_monitor = BlinkMonitor(detector=self.controller.preview_camera.detector,
+                                          ear_threshold=0.23, consec_frames=2)
+        self.blink_monitor.start()
         self.collect_frames = True
 
         # Configurar interfaz para captura
@@ -845,16 +482,14 @@ class CargarPersonaFrame(tk.Frame):
             self.btn_upload.config(state='normal')
             return
 
-        # Verificar parpadeo en los frames capturados
-        frames_to_check = list(self.recent_frames)
-        if len(frames_to_check) < 10:
-            self.instrucciones_label.config(text="Error: no se detectó rostro. Intente nuevamente")
-            self.btn_take.config(state='normal')
-            self.btn_upload.config(state='normal')
-            return
-
+        # Veredicto de parpadeo ya calculado durante la cuenta regresiva
         try:
-            blink_ok = detect_blink_in_frames(frames_to_check, ear_threshold=0.23, consec_frames_for_blink=2)
+            face_frames, blink_ok = self.stop_blink_monitor()
+            if face_frames < 5:
+                self.instrucciones_label.config(text="Error: no se detectó rostro. Intente nuevamente")
+                self.btn_take.config(state='normal')
+                self.btn_upload.config(state='normal')
+                return
             if not blink_ok:
                 self.instrucciones_label.config(text="No se detectó parpadeo. Intente nuevamente")
                 self.btn_take.config(state='normal')
@@ -867,9 +502,9 @@ class CargarPersonaFrame(tk.Frame):
             self.btn_upload.config(state='normal')
             return
 
-        # Capturar frame actual
-        ret, frame = self.controller.cap.read()
-        if ret:
+        # Capturar frame actual del buffer circular de la cámara
+        seq, timestamp, frame = self.controller.camera.ring.latest()
+        if frame is not None:
             timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
             self.photo_path = os.path.join(TEMP_IMAGE_DIR, f"temp_photo_{timestamp}.jpg")
             cv2.imwrite(self.photo_path, frame)
@@ -877,10 +512,6 @@ class CargarPersonaFrame(tk.Frame):
             # Mostrar la foto tomada en el preview
             self.show_photo(self.photo_path)
 
-            # Desactivar recolección de frames
-            self.collect_frames = False
-            self.recent_frames.clear()
-            
             # Habilitar botón guardar
             self.btn_guardar.config(state='normal')
             
@@ -1007,6 +638,11 @@ class BuscarIntrusoFrame(tk.Frame):
         self.status_label = tk.Label(self, text="Iniciando detección...", font=("Arial", 14), bg='#2c3e50', fg='#2ecc71')
         self.status_label.grid(row=2, column=0, pady=10)
         
+        # Profundidad de las colas del pipeline (se actualiza cada segundo)
+        self.queue_label = tk.Label(self, text="", font=("Arial", 10), bg='#2c3e50', fg='#bdc3c7')
+        self.queue_label.grid(row=5, column=0, pady=(0, 10))
+        self.update_queue_status()
+        
         # Frame para la cámara
         camera_frame = tk.Frame(self, bg='#000000')
         camera_frame.grid(row=3, column=0, pady=20, padx=20, sticky='nsew')
@@ -1029,6 +665,14 @@ class BuscarIntrusoFrame(tk.Frame):
                                    command=self.toggle_detection, width=20, height=2, bg='#e74c3c', fg='white')
         self.btn_toggle.pack(side='left', padx=10)
         
+        # Con varias cámaras, elegir cuál se muestra (todas detectan)
+        if len(self.controller.cameras) > 1:
+            self.camera_selector = ttk.Combobox(btn_frame, state='readonly', width=25,
+                                                values=[channel.name for channel in self.controller.cameras])
+            self.camera_selector.current(self.controller.cameras.index(self.controller.preview_camera))
+            self.camera_selector.bind('<<ComboboxSelected>>', self.change_camera)
+            self.camera_selector.pack(side='left', padx=10)
+        
         # Iniciar detección automáticamente si hay cámara disponible
         if self.controller.camera_available:
             self.controller.root.after(1000, self.start_detection_auto)
@@ -1040,6 +684,14 @@ class BuscarIntrusoFrame(tk.Frame):
         """Manejar redimensionamiento para responsividad"""
         pass
     
+    def change_camera(self, event):
+        self.controller.set_preview_camera(self.camera_selector.current())
+    
+    def update_queue_status(self):
+        """Mostrar la profundidad de cada cola mientras la detección está activa"""
+        self.queue_label.config(text=self.controller.pipeline_status())
+        self.controller.root.after(1000, self.update_queue_status)
+    
     def start_detection_auto(self):
         """Iniciar detección automáticamente al entrar en este frame"""
         if not self.controller.detection_active and self.controller.camera_available:
@@ -1108,7 +760,7 @@ class HistorialFrame(tk.Frame):
         tree_frame.grid_rowconfigure(0, weight=1)
         tree_frame.grid_columnconfigure(0, weight=1)
         
-        columns = ("id", "nombre", "dni", "tipo", "fecha")
+        columns = ("id", "nombre", "dni", "tipo", "ubicacion", "vivacidad", "fecha")
         self.tree = ttk.Treeview(tree_frame, columns=columns, show="headings", height=15)
         
         # Definir encabezados
@@ -1116,6 +768,8 @@ class HistorialFrame(tk.Frame):
         self.tree.heading("nombre", text="Nombre")
         self.tree.heading("dni", text="DNI")
         self.tree.heading("tipo", text="Tipo")
+        self.tree.heading("ubicacion", text="Ubicación")
+        self.tree.heading("vivacidad", text="Prueba de vida")
         self.tree.heading("fecha", text="Fecha de Detección")
         
         # Definir anchos de columna
@@ -1123,6 +777,8 @@ class HistorialFrame(tk.Frame):
         self.tree.column("nombre", width=150, anchor='center')
         self.tree.column("dni", width=100, anchor='center')
         self.tree.column("tipo", width=100, anchor='center')
+        self.tree.column("ubicacion", width=120, anchor='center')
+        self.tree.column("vivacidad", width=110, anchor='center')
         self.tree.column("fecha", width=150, anchor='center')
         
         # Añadir scrollbar
@@ -1157,13 +813,13 @@ class HistorialFrame(tk.Frame):
         try:
             conn = sqlite3.connect(DETECTIONS_DB_FILE)
             c = conn.cursor()
-            c.execute("SELECT id, nombre, dni, autorizado, fecha_deteccion FROM detecciones ORDER BY fecha_deteccion DESC")
+            c.execute("SELECT id, nombre, dni, autorizado, fecha_deteccion, ubicacion, vivacidad FROM detecciones ORDER BY fecha_deteccion DESC")
             rows = c.fetchall()
             
             for row in rows:
                 # Convertir valor de autorizado a texto
                 tipo = "AUTORIZADO" if row[3] else "INTRUSO"
-                self.tree.insert("", "end", values=(row[0], row[1], row[2], tipo, row[4]))
+                self.tree.insert("", "end", values=(row[0], row[1], row[2], tipo, row[5], row[6] or "-", row[4]))
             
             conn.close()
             logging.info(f"Detecciones cargadas: {len(rows)}")
@@ -1182,7 +838,7 @@ class HistorialFrame(tk.Frame):
         try:
             conn = sqlite3.connect(DETECTIONS_DB_FILE)
             c = conn.cursor()
-            c.execute("SELECT id, persona_id, nombre, dni, autorizado, fecha_deteccion, foto_blob FROM detecciones WHERE id = ?", (detection_id,))
+            c.execute("SELECT id, persona_id, nombre, dni, autorizado, fecha_deteccion, foto_blob, ubicacion, vivacidad, vivacidad_puntaje FROM detecciones WHERE id = ?", (detection_id,))
             row = c.fetchone()
             conn.close()
             
@@ -1190,7 +846,7 @@ class HistorialFrame(tk.Frame):
                 # Crear ventana de detalles
                 details_window = tk.Toplevel(self)
                 details_window.title(f"Detalles de Detección #{detection_id}")
-                details_window.geometry("500x400")
+                details_window.geometry("500x440")
                 details_window.configure(bg='#2c3e50')
                 details_window.resizable(True, True)
                 
@@ -1209,6 +865,9 @@ class HistorialFrame(tk.Frame):
                 tipo = "AUTORIZADO" if row[4] else "INTRUSO"
                 tk.Label(info_frame, text=f"Tipo: {tipo}", font=("Arial", 12), bg='#2c3e50', fg='white').grid(row=3, column=0, sticky='w', pady=5)
                 tk.Label(info_frame, text=f"Fecha: {row[5]}", font=("Arial", 12), bg='#2c3e50', fg='white').grid(row=4, column=0, sticky='w', pady=5)
+                tk.Label(info_frame, text=f"Ubicación: {row[7]}", font=("Arial", 12), bg='#2c3e50', fg='white').grid(row=5, column=0, sticky='w', pady=5)
+                vivacidad = f"{row[8]} ({row[9]:.2f})" if row[8] and row[9] is not None else (row[8] or "No evaluada")
+                tk.Label(info_frame, text=f"Prueba de vida: {vivacidad}", font=("Arial", 12), bg='#2c3e50', fg='white').grid(row=6, column=0, sticky='w', pady=5)
                 
                 # Mostrar imagen desde BLOB
                 img_frame = tk.Frame(details_window, bg='#34495e')
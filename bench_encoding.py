@@ -0,0 +1,97 @@
+# Benchmark de detección + encodings: hilo único contra pool de procesos
+#
+# Uso: py bench_encoding.py --video entrada.mp4 --frames 200 --processes 2 4 8
+#      py bench_encoding.py --image foto.jpg --frames 100
+#
+# Procesa los mismos frames (reducidos a la mitad, como la app) primero en el
+# hilo actual y después con EncodingPool de distintos tamaños, y compara
+# frames por segundo y caras encontradas.
+import argparse
+import collections
+import os
+import time
+
+import cv2
+import face_recognition
+
+from ebi_workers import EncodingPool
+
+
+def load_frames(args):
+    frames = []
+    if args.image:
+        image = cv2.imread(args.image)
+        if image is None:
+            raise SystemExit(f"No se pudo leer la imagen {args.image}")
+        frames = [image] * args.frames
+    else:
+        cap = cv2.VideoCapture(args.video)
+        while len(frames) < args.frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+    if not frames:
+        raise SystemExit("No hay frames para medir")
+    return [cv2.cvtColor(cv2.resize(f, (0, 0), fx=0.5, fy=0.5), cv2.COLOR_BGR2RGB) for f in frames]
+
+
+def run_single(frames):
+    faces = 0
+    start = time.perf_counter()
+    for rgb in frames:
+        locations = face_recognition.face_locations(rgb)
+        faces += len(face_recognition.face_encodings(rgb, locations))
+    return time.perf_counter() - start, faces
+
+
+def run_pool(frames, processes):
+    pool = EncodingPool(processes, nbytes=frames[0].nbytes)
+    try:
+        # Calentar los workers (importar face_recognition y cargar modelos)
+        warmup = pool.locate(frames[0])
+        warmup.encode(warmup.locations())
+        warmup.release()
+
+        faces = 0
+        in_flight = collections.deque()
+        start = time.perf_counter()
+        for rgb in frames:
+            if len(in_flight) >= processes:
+                job = in_flight.popleft()
+                faces += len(job.encode(job.locations()))
+                job.release()
+            in_flight.append(pool.locate(rgb))
+        while in_flight:
+            job = in_flight.popleft()
+            faces += len(job.encode(job.locations()))
+            job.release()
+        return time.perf_counter() - start, faces
+    finally:
+        pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de detección/encodings en procesos")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--video')
+    source.add_argument('--image')
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--processes', type=int, nargs='+', default=[2, 4, os.cpu_count() or 4])
+    args = parser.parse_args()
+
+    frames = load_frames(args)
+    print(f"{len(frames)} frames de {frames[0].shape[1]}x{frames[0].shape[0]}, {os.cpu_count()} CPUs")
+    print(f"{'modo':<18}{'frames/s':>10}{'caras':>8}")
+
+    elapsed, faces = run_single(frames)
+    print(f"{'hilo único':<18}{len(frames) / elapsed:>10.2f}{faces:>8}")
+
+    for processes in args.processes:
+        elapsed, faces = run_pool(frames, processes)
+        print(f"{f'pool {processes} procesos':<18}{len(frames) / elapsed:>10.2f}{faces:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# Escaneo de grabaciones: reconocimiento sobre videos ya grabados, sin interfaz
+#
+# Uso: py ebi_batch.py grabaciones/ otra.mp4 --stride 5 --workers 8
+#
+# Cada video se divide en tramos que se decodifican en paralelo en un pool de
+# procesos. En cada tramo se analiza uno de cada `stride` frames: detección,
+# seguimiento de caras y encodings solo de caras nuevas (o al re-verificar)
+# que pasen el control de calidad.
+# El proceso principal compara los encodings contra la galería de personas en
+# lotes, confirma la identidad de cada track con k de n votos como en vivo y
+# guarda en detecciones una fila por cara e identidad, con el archivo de
+# origen y el segundo del video.
+import argparse
+import logging
+import multiprocessing
+import os
+import sqlite3
+import time
+from collections import Counter, deque
+
+import cv2
+import face_recognition
+import numpy as np
+
+from ebi_detectors import AutoScale, create_detector, scale_boxes
+from ebi_gallery import EncodingCache, GalleryMatcher
+from ebi_quality import REJECT_REASONS, FaceQualityGate
+from ebi_storage import UNKNOWN_PERSON, create_detections_database, load_gallery
+from ebi_tracking import FaceTracker, IdentityVoter
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.m4v', '.wmv')
+
+
+def find_videos(paths):
+    """Archivos de video de `paths` (los directorios se recorren recursivamente)"""
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                videos.extend(os.path.join(root, f) for f in sorted(files)
+                              if f.lower().endswith(VIDEO_EXTENSIONS))
+        elif os.path.isfile(path):
+            videos.append(path)
+        else:
+            logging.warning(f"No existe {path}")
+    return videos
+
+
+def plan_segments(videos, segment_frames):
+    """Divide cada video en tramos de `segment_frames` frames: (archivo, inicio, fin, fps)"""
+    segments = []
+    for path in videos:
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            logging.error(f"No se pudo abrir {path}")
+            continue
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        cap.release()
+        if total <= 0:
+            # Sin cantidad de frames conocida: un solo tramo hasta el final
+            segments.append((path, 0, float('inf'), fps))
+            continue
+        for start in range(0, total, segment_frames):
+            segments.append((path, start, min(total, start + segment_frames), fps))
+    return segments
+
+
+def scan_segment(path, start, end, fps, stride, backend, options, reverify_every, jpeg_quality,
+                 quality=None, vote_window=5):
+    """
+    En el worker: recorre el tramo [start, end) y devuelve las caras a
+    reconocer como (track_id, segundo, encoding float32, jpeg del frame),
+    junto con los contadores del control de calidad. Cada track se codifica
+    en sus primeras `vote_window` detecciones (los votos de su identidad) y
+    después solo al re-verificar.
+    """
+    cap = cv2.VideoCapture(path)
+    if start:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    detector = create_detector(backend, options)
+    detection_scale = AutoScale()
+    tracker = FaceTracker(reverify_every=reverify_every)
+    quality_gate = FaceQualityGate(**(quality or {}))
+    encoded = Counter()  # encodings calculados por track
+    results = []
+    frames = 0
+
+    index = start
+    while index < end:
+        if (index - start) % stride:
+            # Frames salteados: grab() avanza sin convertir la imagen
+            if not cap.grab():
+                break
+            index += 1
+            continue
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames += 1
+        seconds = index / fps
+        scale = detection_scale.scale
+        small = cv2.resize(frame, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        boxes = detector.locate(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        boxes = scale_boxes(boxes, 1.0 / scale, frame.shape)
+        detection_scale.observe(boxes)
+
+        pending = [track for track, needs_encoding in tracker.update(boxes, seconds) if needs_encoding]
+        if pending:
+            accepted = quality_gate.filter(frame, [track.box for track in pending])
+            for track, ok in zip(pending, accepted):
+                if not ok:
+                    tracker.retry(track)
+            pending = [track for track, ok in zip(pending, accepted) if ok]
+        if pending:
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            encodings = face_recognition.face_encodings(rgb, [track.box for track in pending])
+            success, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+            jpeg = jpeg.tobytes() if success else None
+            for track, encoding in zip(pending, encodings):
+                results.append((track.id, seconds, np.asarray(encoding, dtype=np.float32), jpeg))
+                # Sin reconocimiento en el worker: los votos se cuentan por cantidad
+                encoded[track.id] += 1
+                track.voting = encoded[track.id] < vote_window
+        index += 1
+
+    cap.release()
+    return path, start, frames, results, quality_gate.stats()
+
+
+def _scan_segment(task):
+    try:
+        return scan_segment(*task)
+    except Exception as e:
+        logging.error(f"Error al escanear {task[0]} desde el frame {task[1]}: {e}")
+        return task[0], task[1], 0, [], {}
+
+
+def match_segment(gallery, path, results, tolerance, ubicacion, voter=None):
+    """Filas de detecciones del tramo: una por track e identidad confirmada, como en vivo"""
+    if not results:
+        return []
+    voter = voter or IdentityVoter()
+    encodings = np.stack([encoding for _, _, encoding, _ in results])
+    matches = gallery.match(encodings, tolerance)
+
+    votes = {}
+    reported = {}
+    rows = []
+    for (track_id, seconds, _, jpeg), (face_data, distance) in zip(results, matches):
+        confirmed = voter.vote(votes.setdefault(track_id, deque()), face_data or UNKNOWN_PERSON, distance)
+        if confirmed is None:
+            continue
+        face_data = confirmed[0]
+        if reported.get(track_id) == face_data['id']:
+            continue
+        reported[track_id] = face_data['id']
+        rows.append((face_data['id'], face_data['nombre'], face_data['dni'], face_data['autorizado'],
+                     jpeg, ubicacion, os.path.abspath(path), round(seconds, 3)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconocimiento de rostros sobre videos grabados")
+    parser.add_argument('paths', nargs='+', help="videos o directorios con videos")
+    parser.add_argument('--stride', type=int, default=5, help="analizar uno de cada N frames")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+    parser.add_argument('--segment-frames', type=int, default=1800, help="frames por tramo en paralelo")
+    parser.add_argument('--detector', default='hog', help="hog, cnn, haar o dnn")
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    parser.add_argument('--reverify-every', type=int, default=10)
+    parser.add_argument('--jpeg-quality', type=int, default=85)
+    parser.add_argument('--min-cara', type=int, default=40, help="alto mínimo en píxeles para reconocer una cara")
+    parser.add_argument('--min-nitidez', type=float, default=40.0, help="varianza mínima del Laplaciano")
+    parser.add_argument('--sin-pose', action='store_true', help="no descartar caras de perfil")
+    parser.add_argument('--ubicacion', default='Grabación')
+    parser.add_argument('--db', default='./ebi_database.db')
+    parser.add_argument('--detections-db', default='./detections_database.db')
+    parser.add_argument('--cache', default='./ebi_database', help="prefijo de la caché de encodings")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    videos = find_videos(args.paths)
+    segments = plan_segments(videos, args.segment_frames)
+    if not segments:
+        raise SystemExit("No hay videos para escanear")
+
+    gallery = GalleryMatcher()
+    if not load_gallery(args.db, gallery, EncodingCache(args.cache)):
+        raise SystemExit("No se pudo cargar la galería de personas")
+    create_detections_database(args.detections_db)
+
+    quality = {'min_size': args.min_cara, 'min_sharpness': args.min_nitidez, 'check_pose': not args.sin_pose}
+    voter = IdentityVoter()
+    tasks = [(path, start, end, fps, max(1, args.stride), args.detector, None,
+              args.reverify_every, args.jpeg_quality, quality, voter.window) for path, start, end, fps in segments]
+    video_seconds = sum((end - start) / fps for _, start, end, fps in segments if end != float('inf'))
+
+    conn = sqlite3.connect(args.detections_db)
+    started = time.time()
+    frames = saved = 0
+    rejected = dict.fromkeys(REJECT_REASONS, 0)
+    try:
+        with multiprocessing.get_context('spawn').Pool(args.workers) as pool:
+            for done, (path, start, analyzed, results, counts) in enumerate(pool.imap_unordered(_scan_segment, tasks), 1):
+                rows = match_segment(gallery, path, results, args.tolerance, args.ubicacion, voter)
+                if rows:
+                    conn.executemany("INSERT INTO detecciones (persona_id, nombre, dni, autorizado, foto_blob, "
+                                     "ubicacion, archivo_origen, tiempo_video) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                    conn.commit()
+                frames += analyzed
+                saved += len(rows)
+                for reason in REJECT_REASONS:
+                    rejected[reason] += counts.get(reason, 0)
+                logging.info(f"[{done}/{len(tasks)}] {os.path.basename(path)} desde el frame {start}: "
+                             f"{analyzed} frames analizados, {len(rows)} detecciones")
+    finally:
+        conn.close()
+
+    elapsed = time.time() - started
+    speed = f", {video_seconds / elapsed:.1f}x tiempo real" if video_seconds and elapsed else ""
+    logging.info(f"Escaneo terminado: {len(videos)} videos, {frames} frames analizados, "
+                 f"{saved} detecciones en {elapsed:.1f}s{speed}")
+    logging.info("Caras descartadas por calidad: " + ", ".join(f"{reason} {count}" for reason, count in rejected.items()))
+
+
+if __name__ == "__main__":
+    main()
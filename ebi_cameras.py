@@ -0,0 +1,104 @@
+# Registro de cámaras de EBI: cada cámara con su captura y su estado de detección
+import json
+import logging
+import os
+
+from ebi_capture import CameraReader
+from ebi_detectors import AutoScale
+from ebi_motion import MotionGate
+from ebi_quality import FaceQualityGate
+from ebi_tracking import FaceTracker
+
+# Cámara usada si no hay archivo de registro: la webcam local, como siempre
+DEFAULT_CAMERAS = [{'nombre': 'Cámara 0', 'fuente': 0, 'ubicacion': 'Desconocida'}]
+
+
+def parse_source(source):
+    """'0' o 0 -> índice de dispositivo; cualquier otro texto es archivo o URL"""
+    if isinstance(source, str) and source.strip().isdigit():
+        return int(source)
+    return source
+
+
+def load_camera_registry(path, default=DEFAULT_CAMERAS):
+    """
+    Lee el registro de cámaras: una lista JSON de objetos con 'nombre',
+    'fuente' (índice, archivo de video o URL RTSP) y opcionalmente
+    'ubicacion', 'detector', 'ancho', 'alto' y 'fps'. Si el archivo no
+    existe o no es válido se usa `default`.
+    """
+    cameras = default
+    if os.path.exists(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                cameras = json.load(f)
+            if not isinstance(cameras, list) or not cameras:
+                raise ValueError("se esperaba una lista de cámaras")
+        except Exception as e:
+            logging.error(f"Error al leer el registro de cámaras {path}: {e}")
+            cameras = default
+
+    registry = []
+    for index, camera in enumerate(cameras):
+        source = parse_source(camera.get('fuente', index))
+        registry.append({
+            'nombre': camera.get('nombre', f"Cámara {index}"),
+            'fuente': source,
+            'ubicacion': camera.get('ubicacion', 'Desconocida'),
+            'detector': camera.get('detector'),
+            'ancho': int(camera.get('ancho', 640)),
+            'alto': int(camera.get('alto', 480)),
+            'fps': int(camera.get('fps', 30)),
+        })
+    return registry
+
+
+class CameraChannel:
+    """
+    Una cámara del registro con todo el estado de detección que no se
+    comparte: captura, detector, escala, compuerta de movimiento, control de
+    calidad, tracks y las etapas de detección que la alimentan. La galería y las etapas de
+    reconocimiento, persistencia y alarma son comunes a todas las cámaras.
+    """
+
+    def __init__(self, config, detector, detection_scale=None, reverify_every=10, max_misses=3,
+                 quality_gate=None):
+        self.config = config
+        self.name = config['nombre']
+        self.location = config['ubicacion']
+        self.detector = detector
+        self.reader = CameraReader(config['fuente'], width=config['ancho'],
+                                   height=config['alto'], fps=config['fps'])
+        self.detection_scale = detection_scale or AutoScale()
+        self.motion_gate = MotionGate()
+        # Compuerta aparte para despertar al planificador con la escena vacía
+        # (corre en su hilo, sobre cada frame, y no toca el fondo de motion_gate)
+        self.wake_gate = MotionGate(width=48)
+        self.quality_gate = quality_gate or FaceQualityGate()
+        self.tracker = FaceTracker(max_misses=max_misses, reverify_every=reverify_every)
+        self.active = False
+        self.pipeline = None  # Etapas de detección propias de esta cámara
+        self.scheduler = None
+        self.thread = None
+
+    @property
+    def ring(self):
+        return self.reader.ring
+
+    def start(self):
+        """Abre la captura; False si la fuente no se pudo abrir"""
+        if not self.active:
+            self.active = self.reader.start()
+            if not self.active:
+                logging.warning(f"No se pudo abrir la cámara '{self.name}' ({self.config['fuente']})")
+        return self.active
+
+    def stop(self):
+        if self.active:
+            self.active = False
+            self.reader.stop()
+
+    def reset_detection(self):
+        self.tracker.clear()
+        self.motion_gate.reset()
+        self.wake_gate.reset()
@@ -0,0 +1,192 @@
+# Captura de cámara de EBI: un solo hilo lee el dispositivo y publica los frames
+import logging
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class FrameRing:
+    """
+    Buffer circular preasignado de frames. El hilo de captura escribe cada
+    frame directamente en el siguiente slot y los lectores (vista previa,
+    detección) obtienen una vista del slot sin copiar. Cada frame lleva un
+    número de secuencia y la hora de captura; como un slot se reutiliza
+    después de `slots` frames, quien retenga la vista por más tiempo debe
+    verificar is_valid(seq) o copiarla.
+    """
+
+    def __init__(self, slots=16, shape=(480, 640, 3), dtype=np.uint8):
+        self.slots = slots
+        self.frames = np.zeros((slots,) + tuple(shape), dtype=dtype)
+        self.timestamps = np.zeros(slots, dtype=np.float64)
+        self.seq = -1  # secuencia del último frame publicado
+        self.condition = threading.Condition()
+
+    @property
+    def shape(self):
+        return self.frames.shape[1:]
+
+    def write_slot(self):
+        """Slot donde debe escribirse el próximo frame"""
+        return self.frames[(self.seq + 1) % self.slots]
+
+    def publish(self, timestamp):
+        """Marca el slot de escritura como el último frame y avisa a los lectores"""
+        with self.condition:
+            self.seq += 1
+            self.timestamps[self.seq % self.slots] = timestamp
+            self.condition.notify_all()
+
+    def reshape(self, shape):
+        """Reasigna los slots si la cámara entrega otro tamaño de frame"""
+        with self.condition:
+            self.frames = np.zeros((self.slots,) + tuple(shape), dtype=self.frames.dtype)
+
+    def latest(self):
+        """Devuelve (seq, timestamp, vista) del último frame o (-1, 0, None)"""
+        with self.condition:
+            seq = self.seq
+            if seq < 0:
+                return -1, 0.0, None
+            slot = seq % self.slots
+            return seq, self.timestamps[slot], self.frames[slot]
+
+    def wait_newer(self, seq, timeout=None):
+        """Espera un frame con secuencia mayor a `seq`; devuelve latest() o None si vence"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > seq, timeout=timeout):
+                return None
+        return self.latest()
+
+    def is_valid(self, seq):
+        """True si el slot del frame `seq` todavía no fue sobrescrito"""
+        return seq >= 0 and self.seq - seq < self.slots - 1
+
+    def view(self, seq):
+        """Vista sin copia del frame `seq`, o None si su slot ya se reutilizó"""
+        if not self.is_valid(seq):
+            return None
+        return self.frames[seq % self.slots]
+
+
+class CameraReader:
+    """
+    Dueño único del cv2.VideoCapture: un hilo lee frames lo más rápido que
+    entrega la cámara y los publica en un FrameRing compartido.
+    `source` puede ser el índice de un dispositivo, un archivo de video (se
+    lee al ritmo de sus fps y, con `loop`, vuelve a empezar al terminar) o
+    una URL RTSP/HTTP (se reconecta si deja de entregar frames).
+    """
+
+    def __init__(self, source=0, width=640, height=480, fps=30, slots=16, loop=True):
+        self.source = source
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.loop = loop
+        self.is_file = isinstance(source, str) and os.path.exists(source)
+        self.is_stream = isinstance(source, str) and not self.is_file
+        self.ring = FrameRing(slots, (height, width, 3))
+        self.cap = None
+        self.thread = None
+        self.running = threading.Event()
+
+    def start(self):
+        """Abre el dispositivo y lanza el hilo de captura; False si no se pudo abrir"""
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            cap.release()
+            return False
+
+        if not self.is_file:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+            cap.set(cv2.CAP_PROP_FPS, self.fps)
+        else:
+            self.fps = cap.get(cv2.CAP_PROP_FPS) or self.fps
+
+        # Cada hilo tiene su propio evento: uno viejo que todavía no terminó
+        # (p. ej. trabado abriendo un stream) no sigue corriendo tras un start()
+        self.cap = cap
+        self.running = threading.Event()
+        self.running.set()
+        self.thread = threading.Thread(target=self.capture_loop, args=(cap, self.running), daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """
+        Pide detener la captura. El hilo es el dueño del VideoCapture y lo
+        libera al salir, aunque tarde más que la espera (p. ej. abriendo un
+        stream caído); la captura que abra después de esto se libera sin usarse.
+        """
+        self.running.clear()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=1.0)
+            if self.thread.is_alive():
+                logging.warning(f"La captura de {self.source} sigue terminando en segundo plano")
+        self.thread = None
+        self.cap = None
+
+    def reopen(self, cap, running):
+        """
+        Vuelve a abrir la fuente (fin de archivo con `loop` o stream caído) y
+        devuelve la captura a usar, o None si mientras tanto se pidió detener.
+        """
+        if self.is_file:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            return cap
+        logging.warning(f"Reconectando cámara {self.source}")
+        cap.release()
+        # Esperar antes de reintentar, pero salir enseguida si se detiene
+        for _ in range(10):
+            if not running.is_set():
+                return None
+            time.sleep(0.1)
+        cap = cv2.VideoCapture(self.source)
+        if not running.is_set():
+            # stop() ya volvió mientras se abría: nadie más va a liberarla
+            cap.release()
+            return None
+        self.cap = cap
+        return cap
+
+    def capture_loop(self, cap, running):
+        failures = 0
+        next_frame = time.time()
+        try:
+            while running.is_set():
+                try:
+                    if self.is_file:
+                        # Un archivo se entrega al ritmo de sus fps, como una cámara
+                        delay = next_frame - time.time()
+                        if delay > 0:
+                            time.sleep(delay)
+                        next_frame = max(next_frame, time.time() - 1.0) + 1.0 / self.fps
+                    slot = self.ring.write_slot()
+                    ret, frame = cap.read(slot)
+                    if not ret:
+                        failures += 1
+                        if (self.is_file and self.loop) or (self.is_stream and failures >= 50):
+                            cap = self.reopen(cap, running)
+                            if cap is None:
+                                return
+                            failures = 0
+                        time.sleep(0.01)
+                        continue
+                    failures = 0
+                    if frame.ctypes.data != slot.ctypes.data:
+                        # OpenCV no escribió en el slot (otro tamaño): adaptar el buffer y copiar
+                        if frame.shape != self.ring.shape:
+                            self.ring.reshape(frame.shape)
+                        self.ring.write_slot()[...] = frame
+                    self.ring.publish(time.time())
+                except Exception as e:
+                    logging.error(f"Error en captura de cámara: {e}")
+                    time.sleep(0.1)
+        finally:
+            if cap is not None:
+                cap.release()
@@ -0,0 +1,239 @@
+# Detectores de rostros intercambiables: dlib HOG/CNN (face_recognition) y OpenCV Haar/DNN
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+import cv2
+import face_recognition
+import numpy as np
+
+from ebi_tracking import iou_matrix
+
+
+class FaceDetector:
+    """
+    Interfaz común: locate(rgb) devuelve las cajas (top, right, bottom, left)
+    como face_recognition.face_locations. `spec` (backend, opciones) permite
+    reconstruir el mismo detector en otro proceso.
+    """
+
+    backend = None
+
+    def __init__(self, **options):
+        self.options = options
+
+    @property
+    def spec(self):
+        return self.backend, dict(self.options)
+
+    def locate(self, rgb):
+        raise NotImplementedError
+
+
+class DlibHogDetector(FaceDetector):
+    """HOG de dlib, el detector que la app usó siempre"""
+
+    backend = 'hog'
+
+    def __init__(self, upsample=1):
+        super().__init__(upsample=upsample)
+        self.upsample = upsample
+
+    def locate(self, rgb):
+        return face_recognition.face_locations(rgb, self.upsample, 'hog')
+
+
+class DlibCnnDetector(DlibHogDetector):
+    """CNN de dlib: más preciso con caras de perfil o lejanas, muy lento sin GPU"""
+
+    backend = 'cnn'
+
+    def locate(self, rgb):
+        return face_recognition.face_locations(rgb, self.upsample, 'cnn')
+
+
+class HaarDetector(FaceDetector):
+    """Cascada Haar de OpenCV: la más rápida, con más falsos positivos"""
+
+    backend = 'haar'
+
+    def __init__(self, cascade=None, scale_factor=1.1, min_neighbors=5, min_size=24):
+        super().__init__(cascade=cascade, scale_factor=scale_factor,
+                         min_neighbors=min_neighbors, min_size=min_size)
+        cascade = cascade or os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+        self.classifier = cv2.CascadeClassifier(cascade)
+        if self.classifier.empty():
+            raise FileNotFoundError(f"No se pudo cargar la cascada Haar {cascade}")
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+
+    def locate(self, rgb):
+        gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+        faces = self.classifier.detectMultiScale(gray, scaleFactor=self.scale_factor,
+                                                 minNeighbors=self.min_neighbors,
+                                                 minSize=(self.min_size, self.min_size))
+        return [(int(y), int(x + w), int(y + h), int(x)) for x, y, w, h in faces]
+
+
+class DnnDetector(FaceDetector):
+    """SSD de OpenCV DNN (res10 300x300) cargado desde archivos locales"""
+
+    backend = 'dnn'
+
+    def __init__(self, prototxt='./models/deploy.prototxt',
+                 model='./models/res10_300x300_ssd_iter_140000.caffemodel', confidence=0.5, size=300):
+        super().__init__(prototxt=prototxt, model=model, confidence=confidence, size=size)
+        for path in (prototxt, model):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"No se encontró el modelo DNN {path}")
+        self.net = cv2.dnn.readNetFromCaffe(prototxt, model)
+        self.lock = threading.Lock()  # setInput/forward comparten estado de la red
+        self.confidence = confidence
+        self.size = size
+
+    def locate(self, rgb):
+        height, width = rgb.shape[:2]
+        # El modelo se entrenó con BGR y estas medias por canal
+        bgr = cv2.cvtColor(cv2.resize(rgb, (self.size, self.size)), cv2.COLOR_RGB2BGR)
+        blob = cv2.dnn.blobFromImage(bgr, 1.0, (self.size, self.size), (104.0, 177.0, 123.0))
+        with self.lock:
+            self.net.setInput(blob)
+            detections = self.net.forward()[0, 0]
+        boxes = []
+        for confidence, x1, y1, x2, y2 in detections[:, 2:7]:
+            if confidence < self.confidence:
+                continue
+            left, top = max(0, int(x1 * width)), max(0, int(y1 * height))
+            right, bottom = min(width, int(x2 * width)), min(height, int(y2 * height))
+            if right > left and bottom > top:
+                boxes.append((top, right, bottom, left))
+        return boxes
+
+
+DETECTOR_BACKENDS = {
+    'hog': DlibHogDetector,
+    'cnn': DlibCnnDetector,
+    'haar': HaarDetector,
+    'dnn': DnnDetector,
+}
+
+
+def create_detector(backend='hog', options=None):
+    """Crea el detector `backend` con sus opciones; ValueError si no existe"""
+    if backend not in DETECTOR_BACKENDS:
+        raise ValueError(f"Detector desconocido: {backend}")
+    return DETECTOR_BACKENDS[backend](**(options or {}))
+
+
+def scale_boxes(boxes, factor, shape=None):
+    """Lleva cajas (top, right, bottom, left) a otra escala, recortadas a `shape` (alto, ancho)"""
+    scaled = []
+    for top, right, bottom, left in boxes:
+        box = (int(top * factor), int(math.ceil(right * factor)),
+               int(math.ceil(bottom * factor)), int(left * factor))
+        if shape is not None:
+            height, width = shape[:2]
+            box = (max(0, box[0]), min(width, box[1]), min(height, box[2]), max(0, box[3]))
+        scaled.append(box)
+    return scaled
+
+
+class AutoScale:
+    """
+    Escala de la imagen donde se buscan caras, elegida según el tamaño de las
+    caras observadas: la cara chica típica (percentil `percentile` de las
+    alturas en el frame completo) debe medir al menos `min_face` píxeles en la
+    imagen reducida. En una sala chica con caras grandes se reduce mucho; en
+    un pasillo con caras lejanas casi nada. La escala se redondea hacia arriba
+    a múltiplos de `step` para que no cambie con cada detección.
+    """
+
+    def __init__(self, initial=0.5, min_face=60, min_scale=0.125, max_scale=1.0, step=0.125,
+                 window=200, min_samples=20, percentile=10):
+        self.scale = initial
+        self.min_face = min_face
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.step = step
+        self.min_samples = min_samples
+        self.percentile = percentile
+        self.heights = deque(maxlen=window)
+
+    def observe(self, boxes):
+        """Registra las cajas detectadas (en coordenadas del frame completo)"""
+        for top, right, bottom, left in boxes:
+            self.heights.append(bottom - top)
+        if len(self.heights) >= self.min_samples:
+            small_face = max(1.0, float(np.percentile(self.heights, self.percentile)))
+            scale = math.ceil(self.min_face / small_face / self.step) * self.step
+            self.scale = min(self.max_scale, max(self.min_scale, scale))
+        return self.scale
+
+
+def load_samples(samples_dir):
+    """
+    Conjunto de muestras para elegir detector: imágenes en `samples_dir` y un
+    muestras.json con las caras esperadas de cada una,
+    {"archivo.jpg": [[top, right, bottom, left], ...]}.
+    """
+    with open(os.path.join(samples_dir, 'muestras.json'), encoding='utf-8') as f:
+        labels = json.load(f)
+    samples = []
+    for filename, boxes in labels.items():
+        image = face_recognition.load_image_file(os.path.join(samples_dir, filename))
+        samples.append((image, boxes))
+    return samples
+
+
+def measure(detector, samples, min_iou=0.5):
+    """Devuelve (recall, ms por imagen) del detector sobre las muestras"""
+    found = expected = 0
+    start = time.perf_counter()
+    for image, boxes in samples:
+        detected = detector.locate(image)
+        expected += len(boxes)
+        if boxes and detected:
+            iou = iou_matrix(boxes, detected)
+            found += int(np.sum(iou.max(axis=1) >= min_iou))
+    elapsed = time.perf_counter() - start
+    recall = found / expected if expected else 1.0
+    return recall, 1000.0 * elapsed / max(1, len(samples))
+
+
+def select_detector(samples_dir, backends=('haar', 'dnn', 'hog', 'cnn'), options=None,
+                    min_recall=0.9, default='hog'):
+    """
+    Micro-benchmark de arranque: mide cada backend disponible sobre las
+    muestras y devuelve el más rápido cuyo recall alcance `min_recall`. Si no
+    hay muestras o ninguno lo alcanza, devuelve el detector `default`.
+    """
+    options = options or {}
+    try:
+        samples = load_samples(samples_dir)
+    except Exception as e:
+        logging.warning(f"Sin muestras para elegir detector ({e}), se usa '{default}'")
+        return create_detector(default, options.get(default))
+
+    best, best_ms = None, float('inf')
+    for backend in backends:
+        try:
+            detector = create_detector(backend, options.get(backend))
+            detector.locate(samples[0][0])  # calentar (carga de modelos)
+            recall, ms = measure(detector, samples)
+        except Exception as e:
+            logging.info(f"Detector '{backend}' no disponible: {e}")
+            continue
+        logging.info(f"Detector '{backend}': recall {recall:.2f}, {ms:.1f} ms por imagen")
+        if recall >= min_recall and ms < best_ms:
+            best, best_ms = detector, ms
+
+    if best is None:
+        logging.warning(f"Ningún detector alcanzó recall {min_recall}, se usa '{default}'")
+        return create_detector(default, options.get(default))
+    logging.info(f"Detector elegido: '{best.backend}'")
+    return best
@@ -0,0 +1,864 @@
+# Motor de EBI sin interfaz: captura, detección, persistencia y alertas
+#
+# Uso como servicio: py ebi_engine.py [--sin-sonido] [--sin-correo]
+#
+# La aplicación de escritorio (Actualizacion25-8.py) es un cliente más de este
+# motor: usa las mismas cámaras, la misma galería y las mismas etapas. Este
+# módulo no importa tkinter ni PIL; pygame se carga solo si hay sonido.
+import argparse
+import datetime
+import logging
+import os
+import signal
+import smtplib
+import sqlite3
+import threading
+from email.header import Header
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from functools import partial
+
+import cv2
+import face_recognition
+
+from ebi_cameras import CameraChannel, load_camera_registry
+from ebi_detectors import AutoScale, create_detector, scale_boxes, select_detector
+from ebi_gallery import EncodingCache, GalleryMatcher, decode_encoding, encode_encoding
+from ebi_landmarks import landmarks_for_boxes
+from ebi_liveness import TrackLiveness
+from ebi_motion import locate_in_regions, merge_boxes
+from ebi_pipeline import BLOCK, DROP_OLDEST, DetectionScheduler, Pipeline, Stage
+from ebi_quality import REJECT_REASONS, FaceQualityGate
+from ebi_storage import (UNKNOWN_PERSON, DetectionWriter, create_database, create_detections_database,
+                         load_gallery)
+from ebi_tracking import IdentityVoter
+
+# Configuración global
+DB_FILE = './ebi_database.db'
+DETECTIONS_DB_FILE = './detections_database.db'
+ALARM_SOUND = 'alarm.wav'  # Archivo de sonido de alarma
+MATCH_TOLERANCE = 0.5  # Distancia máxima para considerar que dos rostros coinciden
+MATCH_TOP_K = 3  # Candidatos por cara que se conservan para revisión
+NEAR_MISS_TOLERANCE = 0.6  # Desconocidos más cerca que esto se registran como casi coincidencia
+AMBIGUOUS_MARGIN = 0.05  # Diferencia mínima entre el primer y el segundo candidato
+ANN_INDEX_FILE = './ebi_database_ivf.npz'  # Índice aproximado guardado junto a la base
+ANN_MIN_GALLERY = 100000  # A partir de cuántas personas usar búsqueda aproximada
+ENCODING_CACHE_BASE = './ebi_database'  # Prefijo de la caché .npy de encodings
+# Formato de los encodings nuevos en la base: 'float64' (original), 'float16'
+# o 'int8' (BLOB más chico). Con 'int8' también la galería en memoria queda en
+# int8 (4 veces menos que float32): elige los candidatos y la distancia final
+# se calcula con la caché float32 mapeada en disco
+ENCODING_FORMAT = 'float64'
+# Registro de cámaras (lista JSON con nombre, fuente y ubicación); si no
+# existe se usa solo la webcam 0
+CAMERAS_FILE = './ebi_cameras.json'
+TRACK_REVERIFY_EVERY = 10  # Cada cuántas detecciones se re-verifica la identidad de un track
+TRACK_MAX_MISSES = 3  # Detecciones sin ver una cara antes de cerrar su track
+# Votación de identidad por track antes de guardar o alarmar: (k, n) según
+# 'autorizado' de la persona reconocida; la identidad se confirma cuando k de
+# los últimos n reconocimientos coinciden. Los intrusos y desconocidos (0)
+# se confirman antes que los autorizados (1).
+IDENTITY_VOTES = {0: (2, 3), 1: (3, 5)}
+# Procesos para face_locations/face_encodings (0: en el hilo de detección,
+# como antes). Medir con bench_encoding.py antes de cambiarlo. Con varias
+# cámaras conviene usarlos: el pool se comparte y reparte el trabajo entre
+# núcleos, mientras que los hilos de detección compiten por el intérprete.
+DETECTION_PROCESSES = 0
+DETECTION_IDLE_INTERVAL = 2.0  # Segundos entre detecciones con la escena vacía (el movimiento la despierta antes)
+DETECTION_ACTIVE_HOLD = 5.0  # Segundos sin ver caras antes de pasar a modo vacío
+# Detector de rostros: 'hog' (dlib, el de siempre), 'cnn' (dlib), 'haar' u
+# 'dnn' (OpenCV), o 'auto' para elegir al iniciar el más rápido que alcance
+# DETECTOR_MIN_RECALL sobre las muestras de DETECTOR_SAMPLES_DIR.
+# Ni los modelos DNN ni las muestras vienen con el proyecto: 'dnn' necesita
+# deploy.prototxt y res10_300x300_ssd_iter_140000.caffemodel (los del
+# detector de caras de los ejemplos de OpenCV) en ./models, y 'auto' necesita
+# fotos de las cámaras reales con sus caras anotadas en muestras.json; sin
+# ellas 'auto' usa HOG y 'dnn' no carga (también se usa HOG)
+DETECTOR_BACKEND = 'hog'
+DETECTOR_OPTIONS = {
+    'dnn': {'prototxt': './models/deploy.prototxt',
+            'model': './models/res10_300x300_ssd_iter_140000.caffemodel'},
+}
+DETECTOR_SAMPLES_DIR = './models/muestras'  # Imágenes + muestras.json {"foto.jpg": [[top, right, bottom, left], ...]}
+DETECTOR_MIN_RECALL = 0.9
+# Escala del frame donde se buscan caras (los encodings se calculan siempre
+# sobre el frame completo): 'auto' la ajusta según el tamaño de las caras vistas
+DETECTION_SCALE = 'auto'
+DETECTION_MIN_FACE = 60  # Píxeles que debe medir la cara chica típica en la imagen reducida
+# Calidad mínima de una cara para calcular su encoding (ver ebi_quality):
+# alto en píxeles del frame completo, varianza del Laplaciano y pose según
+# los 5 puntos de referencia (giro y cabeceo relativos a la distancia entre
+# ojos, inclinación en grados)
+FACE_QUALITY = {
+    'min_size': 40,
+    'min_sharpness': 40.0,
+    'max_yaw': 0.3,
+    'pitch_range': (0.3, 1.2),
+    'max_roll': 30.0,
+}
+# Prueba de vida continua de cada track (ver ebi_liveness.TrackLiveness): los
+# landmarks de las caras seguidas se calculan en cada detección y sirven para
+# parpadeos, micro-movimiento y la pose del control de calidad. Una persona
+# autorizada se registra cuando su prueba de vida deja de estar indeterminada
+# (un parpadeo, o 'min_seconds' sin ninguno) o cuando su cara deja de verse.
+# Una prueba sospechosa queda en la detección y manda su propio aviso por
+# correo, pero no convierte a la persona en intruso ni hace sonar la alarma.
+# 'live_motion' está en píxeles del frame: el ruido de los landmarks solo da
+# unos 2 px por frame, con la cara chica o grande
+LIVENESS_CHECK = True
+LIVENESS = {
+    'ear_threshold': 0.23,
+    'consec_frames': 1,
+    'min_frames': 6,
+    'min_seconds': 10.0,
+    'live_motion': 3.5,
+}
+# Las detecciones se guardan desde un único hilo escritor en lotes de hasta
+# DETECTION_WRITE_BATCH filas o DETECTION_WRITE_DELAY segundos de espera
+DETECTION_WRITE_BATCH = 32
+DETECTION_WRITE_DELAY = 0.5
+DETECTION_ROW = ('persona_id', 'nombre', 'dni', 'autorizado', 'foto_blob', 'ubicacion',
+                 'vivacidad', 'vivacidad_puntaje')
+STATUS_INTERVAL = 60.0  # Segundos entre líneas de estado en el log del servicio
+
+# Configuración para enviar correos (modificar con tus datos)
+EMAIL_CONFIG = {
+    'smtp_server': 'smtp.gmail.com',
+    'smtp_port': 587,
+    'email': 'brianbagnato2023@gmail.com',
+    'password': 'opmt nees umbw tfgd',
+    'recipient': 'bgmbagnato@itel.edu.ar'
+}
+
+
+# Backend que eligió 'auto': el micro-benchmark corre una sola vez por proceso
+_auto_backend = {}
+
+
+def build_detector(backend=DETECTOR_BACKEND):
+    """
+    Crea el detector de rostros configurado; si no se puede, usa HOG. Con
+    'auto' se mide una vez y las demás cámaras reciben su propia instancia
+    del backend elegido.
+    """
+    try:
+        if backend == 'auto':
+            if 'backend' not in _auto_backend:
+                detector = select_detector(DETECTOR_SAMPLES_DIR, options=DETECTOR_OPTIONS,
+                                           min_recall=DETECTOR_MIN_RECALL)
+                _auto_backend['backend'] = detector.backend
+                return detector
+            backend = _auto_backend['backend']
+        return create_detector(backend, DETECTOR_OPTIONS.get(backend))
+    except Exception as e:
+        logging.error(f"Error al crear el detector '{backend}': {e}")
+        return create_detector('hog')
+
+
+class EBIEngine:
+    """
+    Cámaras, galería y etapas de detección, reconocimiento, persistencia y
+    alarma, sin dependencias de interfaz. Lo usan el servicio (main) y la
+    aplicación de escritorio, que solo agrega la vista previa y las pantallas.
+    """
+
+    def __init__(self, sound=True, email=True):
+        self.camera_active = False
+        self.detection_active = False
+        self.camera_available = True  # Asumimos que hay cámara disponible inicialmente
+        compact_format = 'int8' if ENCODING_FORMAT == 'int8' else None
+        self.gallery = GalleryMatcher(compact_format=compact_format)  # Matriz de encodings conocidos
+        self.gallery_generation = 0  # Última versión de la galería vista por la detección
+        self.gallery_mtime = None  # Fecha de la base cuando se cargó la galería
+        self.voter = IdentityVoter(IDENTITY_VOTES)
+        self.encoding_cache = EncodingCache(ENCODING_CACHE_BASE)
+        self.pipeline = None  # Etapas comunes a todas las cámaras (ebi_pipeline)
+        self.encoding_pool = None  # Pool de procesos de detección (ebi_workers), si se usa
+        self.stop_detection_flag = threading.Event()
+        # Cada cámara del registro tiene su captura, su detector, sus tracks y
+        # sus etapas de detección; la galería es una sola para todas
+        self.cameras = [self.create_channel(config) for config in load_camera_registry(CAMERAS_FILE)]
+        self.preview_camera = self.cameras[0]  # Cámara que se muestra y se usa para cargar personas
+        self.email = email
+        self.alarm_sound = self.init_sound() if sound else None
+
+        # Crear bases de datos si no existen
+        create_database(DB_FILE)
+        create_detections_database(DETECTIONS_DB_FILE)
+        self.detection_writer = DetectionWriter(DETECTIONS_DB_FILE, DETECTION_ROW,
+                                                batch_size=DETECTION_WRITE_BATCH, max_delay=DETECTION_WRITE_DELAY)
+        self.detection_writer.start()
+
+    def init_sound(self):
+        """Carga el sonido de alarma; pygame se importa solo aquí"""
+        if not os.path.exists(ALARM_SOUND):
+            return None
+        try:
+            import pygame
+            pygame.mixer.init()
+            logging.info("Mixer de pygame inicializado correctamente")
+            return pygame.mixer.Sound(ALARM_SOUND)
+        except Exception as e:
+            logging.error(f"Error al inicializar pygame mixer: {e}")
+            return None
+
+    def create_channel(self, config):
+        """Crea el estado de una cámara del registro con su detector y escala"""
+        detector = build_detector(config['detector'] or DETECTOR_BACKEND)
+        if DETECTION_SCALE == 'auto':
+            detection_scale = AutoScale(min_face=DETECTION_MIN_FACE)
+        else:
+            detection_scale = AutoScale(initial=DETECTION_SCALE, min_samples=float('inf'))
+        return CameraChannel(config, detector, detection_scale,
+                             reverify_every=TRACK_REVERIFY_EVERY, max_misses=TRACK_MAX_MISSES,
+                             quality_gate=FaceQualityGate(**FACE_QUALITY))
+
+    # ----------------- Galería de personas -----------------
+    def load_personas(self):
+        try:
+            self.gallery_mtime = os.path.getmtime(DB_FILE)
+        except OSError:
+            self.gallery_mtime = None
+        return load_gallery(DB_FILE, self.gallery, self.encoding_cache,
+                            ann_index_file=ANN_INDEX_FILE, ann_min_gallery=ANN_MIN_GALLERY)
+
+    def reload_personas_if_changed(self):
+        """Recargar la galería si otro proceso (p. ej. la app de escritorio) modificó la base"""
+        try:
+            mtime = os.path.getmtime(DB_FILE)
+        except OSError:
+            return False
+        if mtime == self.gallery_mtime:
+            return False
+        logging.info("La base de personas cambió, recargando la galería")
+        return self.load_personas()
+
+    def find_persona_by_dni(self, dni):
+        """(id, nombre) de la primera persona con ese DNI, o None"""
+        conn = sqlite3.connect(DB_FILE)
+        try:
+            return conn.execute("SELECT id, nombre FROM personas WHERE dni = ? ORDER BY id LIMIT 1",
+                                (dni,)).fetchone()
+        finally:
+            conn.close()
+
+    def add_persona(self, nombre, dni, desc, foto_blob, face_encoding, autorizado):
+        """Guarda una persona nueva en la base y en la galería; devuelve su id"""
+        encoding_blob = encode_encoding(face_encoding, ENCODING_FORMAT)
+        conn = sqlite3.connect(DB_FILE)
+        try:
+            c = conn.cursor()
+            c.execute("INSERT INTO personas (nombre, dni, descripcion, autorizado, foto_blob, encoding, encoding_format) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                      (nombre, dni, desc, autorizado, foto_blob, encoding_blob, ENCODING_FORMAT))
+            persona_id = c.lastrowid
+            conn.commit()
+            version = c.execute("SELECT version FROM personas_version").fetchone()[0]
+        finally:
+            conn.close()
+
+        # Agregar la persona a la galería en memoria sin recargar toda la base
+        encoding = decode_encoding(encoding_blob, ENCODING_FORMAT)
+        self.gallery.add(persona_id, encoding, {
+            'id': persona_id,
+            'nombre': nombre,
+            'dni': dni,
+            'desc': desc,
+            'autorizado': autorizado
+        })
+        # Y a la caché de encodings, para que el próximo arranque la siga usando
+        # (después de la galería, que ya soltó el mapeo de los archivos)
+        self.encoding_cache.append(persona_id, encoding, version)
+        self.gallery_mtime = os.path.getmtime(DB_FILE)
+        return persona_id
+
+    def add_template(self, persona_id, face_encoding):
+        """Agrega otra foto (plantilla) a una persona existente"""
+        encoding_blob = encode_encoding(face_encoding, ENCODING_FORMAT)
+        conn = sqlite3.connect(DB_FILE)
+        try:
+            conn.execute("INSERT INTO persona_templates (persona_id, encoding, encoding_format) VALUES (?, ?, ?)",
+                         (persona_id, encoding_blob, ENCODING_FORMAT))
+            conn.commit()
+        finally:
+            conn.close()
+        self.gallery.add_template(persona_id, decode_encoding(encoding_blob, ENCODING_FORMAT))
+        self.gallery_mtime = os.path.getmtime(DB_FILE)
+
+    # ----------------- Cámaras -----------------
+    def start_camera(self):
+        if not self.camera_active:
+            try:
+                # Un hilo por cámara lee el dispositivo y publica los frames en
+                # su buffer circular, compartido por la vista previa y la detección
+                started = [channel for channel in self.cameras if channel.start()]
+                if not started:
+                    self.camera_available = False
+                    logging.warning("No se pudo abrir ninguna cámara")
+                    return False
+                if not self.preview_camera.active:
+                    self.preview_camera = started[0]
+
+                self.camera_active = True
+                self.camera_available = True
+                logging.info(f"Cámaras iniciadas correctamente: {len(started)} de {len(self.cameras)}")
+                return True
+            except Exception as e:
+                self.camera_available = False
+                logging.error(f"Error al iniciar la cámara: {e}")
+                return False
+        return True
+
+    def stop_camera(self):
+        if self.camera_active:
+            self.camera_active = False
+            for channel in self.cameras:
+                channel.stop()
+            logging.info("Cámara detenida")
+
+    def set_preview_camera(self, index):
+        """Cambiar la cámara que se muestra en pantalla; False si no está activa"""
+        channel = self.cameras[index]
+        if channel.active:
+            self.preview_camera = channel
+            return True
+        return False
+
+    # ----------------- Detección -----------------
+    def start_detection(self):
+        if self.detection_active:
+            # Ya en marcha (p. ej. el arranque automático y la pantalla de búsqueda)
+            return True
+        if not self.camera_active:
+            if not self.start_camera():
+                return False
+
+        self.detection_active = True
+        self.stop_detection_flag.clear()
+
+        # Etapas de la detección, cada una en su hilo: los frames se descartan
+        # si la detección está ocupada (gana el más nuevo) y las detecciones
+        # nunca se pierden (si la base o la alarma se atrasan, esperan).
+        # Reconocimiento, persistencia y alarma son comunes a todas las cámaras
+        self.pipeline = Pipeline([
+            Stage('reconocimiento', self.match_faces, maxsize=max(4, len(self.cameras)), policy=BLOCK),
+            Stage('persistencia', self.persist_detection, maxsize=64, policy=BLOCK),
+            Stage('alarma', self.alarm_stage, maxsize=16, policy=BLOCK),
+        ])
+        self.pipeline.start()
+
+        if DETECTION_PROCESSES > 0 and self.encoding_pool is None:
+            # multiprocessing se carga solo si se usan procesos
+            from ebi_workers import EncodingPool
+            self.encoding_pool = EncodingPool(DETECTION_PROCESSES)
+        for channel in self.cameras:
+            if channel.active:
+                self.start_channel_detection(channel)
+
+        logging.info("Detección iniciada")
+        return True
+
+    def start_channel_detection(self, channel):
+        """Etapas e hilo de detección propios de una cámara"""
+        channel.reset_detection()
+        if DETECTION_PROCESSES > 0:
+            # Varios frames en vuelo en el pool; la cola de recolección los
+            # mantiene en orden de captura y limita cuántos hay a la vez
+            detection = [
+                Stage(f'despacho:{channel.name}', partial(self.dispatch_faces, channel),
+                      maxsize=1, policy=DROP_OLDEST),
+                Stage(f'deteccion:{channel.name}', partial(self.collect_faces, channel),
+                      maxsize=DETECTION_PROCESSES, policy=BLOCK),
+            ]
+        else:
+            detection = [Stage(f'deteccion:{channel.name}', partial(self.detect_faces, channel),
+                               maxsize=1, policy=DROP_OLDEST)]
+        channel.pipeline = Pipeline(detection, output=self.pipeline)
+        channel.pipeline.start()
+
+        # Iniciar hilo de detección: entrega frames a medida que llegan,
+        # tan seguido como permita la latencia si hay gente en escena
+        channel.scheduler = DetectionScheduler(channel.ring, channel.pipeline,
+                                               detection_stages=len(detection),
+                                               idle_interval=DETECTION_IDLE_INTERVAL,
+                                               active_hold=DETECTION_ACTIVE_HOLD,
+                                               wake=lambda frame: bool(channel.wake_gate.regions(frame)))
+        channel.thread = threading.Thread(target=channel.scheduler.run,
+                                          args=(self.stop_detection_flag,), daemon=True)
+        channel.thread.start()
+
+    def stop_detection(self):
+        self.detection_active = False
+        self.stop_detection_flag.set()
+        # Primero las etapas de cada cámara (terminan de entregar lo pendiente)
+        # y después las comunes
+        for channel in self.cameras:
+            if channel.thread and channel.thread.is_alive():
+                channel.thread.join(timeout=1.0)
+            channel.thread = None
+            if channel.pipeline:
+                channel.pipeline.stop()
+                channel.pipeline = None
+        if self.pipeline:
+            self.pipeline.stop()
+            self.pipeline = None
+        logging.info("Detección detenida")
+
+    def shutdown(self):
+        """Detener todo, guardar las detecciones pendientes y liberar el pool de procesos"""
+        self.stop_detection()
+        self.stop_camera()
+        self.detection_writer.stop()
+        if self.encoding_pool:
+            self.encoding_pool.close()
+            self.encoding_pool = None
+
+    def pipeline_status(self):
+        """Profundidad de las colas comunes y actividad de las cámaras, para mostrar en pantalla"""
+        if not self.pipeline:
+            return ""
+        status = "Colas: " + "  ".join(f"{name}={depth}" for name, depth in self.pipeline.depths().items())
+        writer = self.detection_writer
+        status += f"  escritura={writer.pending()} (a disco={writer.spilled}, fallidas={writer.failed})"
+        channels = [channel for channel in self.cameras if channel.scheduler and channel.active]
+        busy = sum(1 for channel in channels if channel.scheduler.active())
+        status += f"  |  Cámaras con actividad: {busy}/{len(channels)}"
+        quality = self.quality_stats()
+        rejected = sum(quality[reason] for reason in REJECT_REASONS)
+        if rejected:
+            detalle = ", ".join(f"{reason} {quality[reason]}" for reason in REJECT_REASONS)
+            status += f"  |  Caras descartadas: {rejected}/{rejected + quality['aceptadas']} ({detalle})"
+        scheduler = self.preview_camera.scheduler
+        if scheduler:
+            escena = "con actividad" if scheduler.active() else "vacía"
+            status += f"  |  {self.preview_camera.name}: escena {escena}, cada {scheduler.interval():.2f} s"
+        return status
+
+    def stage_report(self):
+        """Tiempo medio, procesados y descartes de cada etapa (por cámara y comunes), para el log del servicio"""
+        pipelines = [channel.pipeline for channel in self.cameras if channel.pipeline]
+        if self.pipeline:
+            pipelines.append(self.pipeline)
+        parts = [f"{name} {stats['avg_ms']:.1f} ms ({stats['processed']} procesados, {stats['dropped']} descartados)"
+                 for pipeline in pipelines for name, stats in pipeline.stats().items()]
+        return "Etapas: " + "; ".join(parts) if parts else ""
+
+    def quality_stats(self):
+        """Caras aceptadas y rechazadas por motivo, sumadas en todas las cámaras"""
+        totals = {}
+        for channel in self.cameras:
+            for key, count in channel.quality_gate.stats().items():
+                totals[key] = totals.get(key, 0) + count
+        return totals
+
+    def latest_valid(self, channel, item):
+        """Si el frame esperó en la cola y su slot ya se reutilizó, usar el último"""
+        if channel.ring.is_valid(item['seq']):
+            return item
+        seq, timestamp, frame = channel.ring.latest()
+        return {'seq': seq, 'timestamp': timestamp, 'frame': frame}
+
+    def detect_faces(self, channel, item, emit):
+        """Etapa de detección: localizar rostros y calcular sus encodings"""
+        if not channel.active:
+            return
+        item = self.latest_valid(channel, item)
+
+        # Buscar caras en el frame reducido (rápido) y calcular los encodings
+        # sobre el frame completo (más preciso con caras lejanas)
+        frame = item['frame']
+        scale = channel.detection_scale.scale
+        small_frame = cv2.resize(frame, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        regions = self.motion_regions(channel, small_frame, scale, item['timestamp'])
+        if not regions:
+            return
+        rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+
+        # Detectar rostros solo en las zonas con movimiento o caras seguidas
+        face_locations = locate_in_regions(rgb_small_frame, regions, channel.detector.locate)
+        face_locations = scale_boxes(face_locations, 1.0 / scale, frame.shape)
+        # El frame RGB completo se convierte una vez para landmarks y encodings
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) if face_locations else None
+        encode = lambda boxes: face_recognition.face_encodings(rgb, boxes)
+        self.track_and_encode(channel, item, face_locations, encode, emit, rgb)
+
+    def dispatch_faces(self, channel, item, emit):
+        """Etapa de despacho (modo procesos): enviar el frame al pool sin esperar el resultado"""
+        if not channel.active:
+            return
+        item = self.latest_valid(channel, item)
+
+        # El frame completo va al pool: el worker lo reduce para detectar y
+        # calcula los encodings sobre la imagen completa
+        scale = channel.detection_scale.scale
+        small_frame = cv2.resize(item['frame'], (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        if not self.motion_regions(channel, small_frame, scale, item['timestamp']):
+            return
+        backend, options = channel.detector.spec
+        job = self.encoding_pool.locate(cv2.cvtColor(item['frame'], cv2.COLOR_BGR2RGB), backend, options,
+                                        scale=scale, timeout=1.0)
+        if job is None:
+            return
+        # La evidencia se copia ya: el resultado llega más tarde y el slot se reutiliza
+        emit({'seq': item['seq'], 'timestamp': item['timestamp'], 'frame': item['frame'].copy(),
+              'evidence': True, 'job': job})
+
+    def motion_regions(self, channel, small_frame, scale, timestamp):
+        """Zonas del frame reducido donde buscar rostros: movimiento respecto del fondo y caras ya seguidas"""
+        regions = channel.motion_gate.regions(small_frame)
+        if channel.scheduler:
+            # El movimiento también mantiene la escena activa, no solo las caras
+            channel.scheduler.notify_activity(len(regions))
+        height, width = small_frame.shape[:2]
+        for top, right, bottom, left in scale_boxes(channel.tracker.predicted_boxes(timestamp), scale):
+            # Margen para que la cara siga dentro aunque se mueva (o esté quieta)
+            pad_y, pad_x = (bottom - top) // 2, (right - left) // 2
+            regions.append((max(0, top - pad_y), min(width, right + pad_x),
+                            min(height, bottom + pad_y), max(0, left - pad_x)))
+        return merge_boxes(regions)
+
+    def collect_faces(self, channel, item, emit):
+        """Etapa de recolección (modo procesos): resultados del pool en orden de captura"""
+        job = item['job']
+        try:
+            face_locations = job.locations(timeout=30)
+            self.track_and_encode(channel, item, face_locations, job.encode, emit)
+        finally:
+            job.release()
+
+    def track_and_encode(self, channel, item, face_locations, encode, emit, rgb=None):
+        """Asociar las caras a sus tracks y calcular encodings solo de las que lo necesitan"""
+        if channel.scheduler:
+            channel.scheduler.notify_activity(len(face_locations))
+        channel.detection_scale.observe(face_locations)
+
+        # Si no hay rostros conocidos, saltar detección
+        if not len(self.gallery):
+            return
+
+        # Asociar cada cara con su track; solo las nuevas o las que toca
+        # re-verificar necesitan encoding
+        tracked = channel.tracker.update(face_locations, item['timestamp'])
+        landmarks = self.update_liveness(item['frame'], item['timestamp'], tracked, rgb) if LIVENESS_CHECK else None
+        pending = [track for track, needs_encoding in tracked if needs_encoding]
+        # Identidades ya confirmadas cuya prueba de vida se acaba de resolver:
+        # se registran sin volver a codificar la cara
+        resolved = [track for track, _ in tracked if track.pending_identity is not None
+                    and track.liveness is not None and track.liveness.state()[0] != 'indeterminado']
+        # Tracks que se cerraron con una identidad todavía esperando la prueba de vida
+        abandoned = channel.tracker.take_abandoned()
+
+        # Caras chicas, borrosas o de perfil no se codifican: el track lo
+        # vuelve a intentar en la próxima detección
+        if pending:
+            if landmarks is not None:
+                landmarks = [landmarks[track.id] for track in pending]
+            accepted = channel.quality_gate.filter(item['frame'], [track.box for track in pending], landmarks)
+            for track, ok in zip(pending, accepted):
+                if not ok:
+                    channel.tracker.retry(track)
+            pending = [track for track, ok in zip(pending, accepted) if ok]
+        if not pending and not resolved and not abandoned:
+            return
+        face_encodings = encode([track.box for track in pending]) if pending else []
+
+        # Copiar el frame como evidencia solo cuando hay rostros: el slot
+        # del buffer circular se reutiliza mientras seguimos procesando
+        evidence = item['frame']
+        if not item.get('evidence'):
+            evidence = evidence.copy()
+            if not channel.ring.is_valid(item['seq']):
+                logging.warning("El frame de la detección fue sobrescrito antes de copiarse")
+
+        emit({'seq': item['seq'], 'timestamp': item['timestamp'], 'frame': evidence,
+              'camera': channel, 'tracks': pending, 'encodings': face_encodings, 'resolved': resolved,
+              'abandoned': abandoned})
+
+    def update_liveness(self, frame, timestamp, tracked, rgb=None):
+        """
+        Landmarks de todas las caras seguidas en este frame (por id de track,
+        None si no son plausibles) y actualización de la prueba de vida de cada
+        track con ellos. Usa las cajas del tracker: no se detecta nada extra.
+        """
+        if not tracked:
+            return {}
+        if rgb is None:
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        try:
+            found = landmarks_for_boxes(rgb, [track.box for track, _ in tracked])
+        except Exception as e:
+            logging.error(f"Error al calcular landmarks para la prueba de vida: {e}")
+            return None
+        landmarks = {}
+        for (track, _), points in zip(tracked, found):
+            landmarks[track.id] = points
+            if points is None:
+                continue
+            if track.liveness is None:
+                track.liveness = TrackLiveness(**LIVENESS)
+            track.liveness.update(points, timestamp)
+        return landmarks
+
+    def match_faces(self, item, emit):
+        """Etapa de reconocimiento: comparar contra la galería y votar la identidad de cada track"""
+        # Si la galería cambió, re-verificar los tracks de personas eliminadas
+        if self.gallery.generation != self.gallery_generation:
+            self.gallery_generation = self.gallery.generation
+            for channel in self.cameras:
+                channel.tracker.forget_identities(lambda persona_id: persona_id in self.gallery)
+
+        # Comparar todas las caras del frame contra la galería de una vez
+        # y quedarse con la persona más cercana (no la primera que coincida)
+        results = self.gallery.top_k(item['encodings'], k=MATCH_TOP_K)
+        for track, (candidates, margin) in zip(item['tracks'], results):
+            face_data, distance = candidates[0] if candidates else (None, float('inf'))
+            if distance > MATCH_TOLERANCE:
+                face_data = None
+            self.log_near_miss(candidates, margin, face_data)
+
+            if face_data is None:
+                # Rostro desconocido - tratar como intruso
+                face_data = UNKNOWN_PERSON
+
+            # Un solo frame no alcanza: la identidad se confirma con k de n
+            # votos coincidentes, y mientras no se confirme (o si el último
+            # voto la contradice) el track se sigue codificando en cada detección
+            confirmed = self.voter.vote(track.votes, face_data, distance)
+            track.voting = confirmed is None or confirmed[0]['id'] != face_data['id']
+            if confirmed is None:
+                continue
+            face_data, track.distance = confirmed
+            track.identity = face_data
+
+            # Registrar cada track una sola vez por identidad: mientras la misma
+            # cara siga a la vista no se repite la detección, pero si al
+            # re-verificar cambia de identidad se registra de nuevo
+            if track.reported_id == face_data['id']:
+                track.pending_identity = None
+                track.pending_frame = None
+                continue
+            liveness = track.liveness.state() if track.liveness else ('indeterminado', 0.0)
+            # Si el track se cerró mientras se reconocía, no hay prueba que esperar
+            closed = track.misses > item['camera'].tracker.max_misses
+            if LIVENESS_CHECK and face_data['autorizado'] and liveness[0] == 'indeterminado' and not closed:
+                # Autorizado sin prueba de vida todavía: queda en el track (con
+                # este frame como evidencia) y se registra cuando la detección
+                # la resuelva o cuando el track se cierre (un intruso, ya)
+                track.pending_identity = face_data
+                track.pending_frame = item['frame']
+                continue
+            track.pending_identity = None
+            track.pending_frame = None
+            self.report(track, face_data, liveness, item, emit)
+
+        for track in item.get('resolved', ()):
+            face_data = track.pending_identity
+            track.pending_identity = None
+            track.pending_frame = None
+            if face_data is None or track.reported_id == face_data['id']:
+                continue
+            self.report(track, face_data, track.liveness.state(), item, emit)
+
+        # La cara se fue antes de resolver la prueba de vida: se registra con
+        # el frame en que se confirmó la identidad y la prueba como quedó
+        for track in item.get('abandoned', ()):
+            face_data, frame = track.pending_identity, track.pending_frame
+            track.pending_identity = None
+            track.pending_frame = None
+            if face_data is None or track.reported_id == face_data['id']:
+                continue
+            liveness = track.liveness.state() if track.liveness else ('indeterminado', 0.0)
+            self.report(track, face_data, liveness, dict(item, frame=frame), emit)
+
+    def report(self, track, face_data, liveness, item, emit):
+        """Emitir la detección de un track (una vez por identidad) hacia persistencia y alarma"""
+        track.reported_id = face_data['id']
+        if face_data['autorizado'] and liveness[0] == 'sospechoso':
+            # Posible foto o pantalla, o alguien que no parpadeó a tiempo: la
+            # detección queda como autorizada con la prueba sospechosa y se avisa aparte
+            logging.warning(f"Prueba de vida sospechosa para {face_data['nombre']} "
+                            f"en {item['camera'].location} (puntaje {liveness[1]:.2f})")
+        emit({'face_data': face_data, 'frame': item['frame'], 'timestamp': item['timestamp'],
+              'ubicacion': item['camera'].location, 'vivacidad': liveness})
+
+    def persist_detection(self, event, emit):
+        """Etapa de persistencia: guardar la detección y pasar intrusos y pruebas de vida sospechosas a la alarma"""
+        self.save_detection(event['face_data'], event['frame'], event['ubicacion'], event.get('vivacidad'))
+
+        # Activar alarma solo si es un intruso (no autorizado); una persona
+        # autorizada con prueba de vida sospechosa solo genera su aviso
+        if not event['face_data']['autorizado'] or (event.get('vivacidad') or ('',))[0] == 'sospechoso':
+            emit(event)
+
+    def alarm_stage(self, event, emit):
+        """Etapa de alarma: sonido y correo (el correo sigue en su propio hilo)"""
+        if event['face_data']['autorizado']:
+            self.trigger_liveness_alert(event['face_data'], event['frame'], event['ubicacion'], event['vivacidad'])
+        else:
+            self.trigger_alarm(event['face_data'], event['frame'], event['ubicacion'])
+
+    def log_near_miss(self, candidates, margin, face_data):
+        """Registrar coincidencias ambiguas o casi coincidencias para revisión del operador"""
+        if not candidates:
+            return
+        best_data, best_distance = candidates[0]
+        resumen = ", ".join(f"{data['nombre']} ({distance:.3f})" for data, distance in candidates)
+        if face_data is not None and margin < AMBIGUOUS_MARGIN:
+            logging.warning(f"Coincidencia ambigua (margen {margin:.3f}): {resumen}")
+        elif face_data is None and best_distance <= NEAR_MISS_TOLERANCE:
+            logging.info(f"Casi coincidencia con {best_data['nombre']} ({best_distance:.3f}): {resumen}")
+
+    # ----------------- Persistencia y alertas -----------------
+    def save_detection(self, face_data, frame, ubicacion='Desconocida', vivacidad=None):
+        try:
+            # Convertir frame a bytes para almacenar como BLOB
+            success, encoded_image = cv2.imencode('.jpg', frame)
+            if not success:
+                logging.error("Error al codificar la imagen para la detección")
+                return
+
+            image_bytes = encoded_image.tobytes()
+
+            # El escritor la guarda en el próximo lote (sin esperar el commit)
+            estado, puntaje = vivacidad or (None, None)
+            self.detection_writer.put((face_data['id'], face_data['nombre'], face_data['dni'], face_data['autorizado'],
+                                       image_bytes, ubicacion, estado, puntaje), self.stop_detection_flag)
+
+            logging.info(f"Detección registrada: {face_data['nombre']} en {ubicacion}")
+        except Exception as e:
+            logging.error(f"Error al guardar detección: {e}")
+
+    def trigger_alarm(self, face_data, frame, ubicacion='Ubicación no especificada'):
+        # Reproducir sonido de alarma
+        if self.alarm_sound is not None:
+            try:
+                self.alarm_sound.play()
+            except Exception:
+                pass  # Silenciar errores de sonido para no bloquear la detección
+
+        # Enviar alerta por correo en segundo plano
+        if self.email:
+            threading.Thread(target=self.send_alert, args=(face_data, frame.copy(), ubicacion), daemon=True).start()
+
+    def trigger_liveness_alert(self, face_data, frame, ubicacion, vivacidad):
+        """Aviso por correo de una persona autorizada con prueba de vida sospechosa (sin sonido)"""
+        if self.email:
+            threading.Thread(target=self.send_alert, args=(face_data, frame.copy(), ubicacion, vivacidad),
+                             daemon=True).start()
+
+    def send_alert(self, face_data, frame, ubicacion='Ubicación no especificada', vivacidad=None):
+        # La imagen se adjunta desde memoria: no quedan archivos temporales que limpiar
+        success, encoded_image = cv2.imencode('.jpg', frame)
+        if not success:
+            logging.error("Error al codificar la imagen para el correo")
+            return
+        self.send_email_alert(face_data, encoded_image.tobytes(), ubicacion, vivacidad)
+
+    def send_email_alert(self, face_data, img_data, ubicacion='Ubicación no especificada', vivacidad=None):
+        try:
+            msg = MIMEMultipart()
+            msg['From'] = EMAIL_CONFIG['email']
+            msg['To'] = EMAIL_CONFIG['recipient']
+
+            # Codificación robusta para caracteres especiales
+            if vivacidad:
+                subject = "Prueba de vida sospechosa de una persona autorizada"
+            else:
+                subject = "Alerta de intruso detectado!"
+            msg['Subject'] = Header(subject, 'utf-8')
+
+            # Crear cuerpo del mensaje con encoding seguro
+            body_content = {
+                'nombre': face_data['nombre'] or 'Desconocido',
+                'dni': face_data['dni'] or 'No disponible',
+                'desc': face_data['desc'] or 'Sin descripción',
+                'fecha': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'ubicacion': ubicacion
+            }
+
+            # Usar una plantilla detallada
+            if vivacidad:
+                titulo = f"PRUEBA DE VIDA SOSPECHOSA (puntaje {vivacidad[1]:.2f}) - SISTEMA EBI"
+                seccion = "PERSONA AUTORIZADA RECONOCIDA"
+                aviso = ("No se vio un parpadeo ni movimiento del rostro: puede ser una foto o una "
+                         "pantalla. Por favor, verificar.")
+            else:
+                titulo = "ALERTA DE INTRUSO DETECTADO - SISTEMA EBI"
+                seccion = "INFORMACIÓN DEL INTRUSO"
+                aviso = "Se ha detectado a esta persona en las inmediaciones. Por favor, verificar."
+            body = f"""
+            {titulo}
+
+            {seccion}:
+            • Nombre: {body_content['nombre']}
+            • DNI: {body_content['dni']}
+            • Descripción: {body_content['desc']}
+
+            INFORMACIÓN DE LA DETECCIÓN:
+            • Fecha y Hora: {body_content['fecha']}
+            • Ubicación: {body_content['ubicacion']}
+            • Sistema: EBI - Escáner Biométrico Inteligente
+
+            {aviso}
+            """
+
+            msg.attach(MIMEText(body, 'plain', 'utf-8'))
+
+            # Adjuntar imagen
+            img = MIMEImage(img_data, 'jpeg')
+            img.add_header('Content-Disposition', 'attachment', filename='detection.jpg')
+            msg.attach(img)
+
+            # Enviar correo
+            server = smtplib.SMTP(EMAIL_CONFIG['smtp_server'], EMAIL_CONFIG['smtp_port'])
+            server.starttls()
+            server.login(EMAIL_CONFIG['email'], EMAIL_CONFIG['password'])
+            server.send_message(msg)
+            server.quit()
+
+            logging.info(f"Email de alerta enviado para: {face_data['nombre']}")
+
+        except Exception as e:
+            logging.error(f"Error al enviar correo: {str(e)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EBI como servicio: detección sin interfaz gráfica")
+    parser.add_argument('--sin-sonido', action='store_true', help="no reproducir la alarma")
+    parser.add_argument('--sin-correo', action='store_true', help="no enviar alertas por correo")
+    parser.add_argument('--estado', type=float, default=STATUS_INTERVAL,
+                        help="segundos entre líneas de estado en el log")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("ebi_log.log", encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+
+    engine = EBIEngine(sound=not args.sin_sonido, email=not args.sin_correo)
+    engine.load_personas()
+    if not engine.start_detection():
+        raise SystemExit("No se pudo iniciar ninguna cámara")
+
+    # Detener limpio con Ctrl+C o con la señal del administrador de servicios
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    try:
+        while not stop.wait(args.estado):
+            # Las personas cargadas desde la app de escritorio entran sin reiniciar
+            engine.reload_personas_if_changed()
+            logging.info(engine.pipeline_status())
+            report = engine.stage_report()
+            if report:
+                logging.info(report)
+    finally:
+        engine.shutdown()
+
+
+if __name__ == "__main__":
+    main()
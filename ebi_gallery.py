@@ -0,0 +1,822 @@
+# Galería de rostros conocidos para el reconocimiento de EBI
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+import numpy as np
+
+ENCODING_SIZE = 128  # Dimensión de los encodings de face_recognition
+
+
+def squared_distances(queries, matrix, sq_norms):
+    """
+    Distancias euclídeas al cuadrado (consultas x filas) calculadas como
+    ||a||² + ||b||² - 2·a·b con un único producto matricial.
+    """
+    q_norms = np.einsum('ij,ij->i', queries, queries)
+    d2 = q_norms[:, None] + sq_norms[None, :] - 2.0 * (queries @ matrix.T)
+    np.maximum(d2, 0.0, out=d2)  # errores de redondeo pueden dar negativos
+    return d2
+
+
+def matrix_checksum(matrix):
+    """Huella rápida de la galería para saber si un índice guardado sigue vigente"""
+    return zlib.crc32(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+
+
+def grow(array, needed):
+    """Devuelve array con capacidad para al menos `needed` filas (duplicando)"""
+    if len(array) >= needed:
+        return array
+    capacity = max(needed, 2 * len(array), 16)
+    bigger = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    bigger[:len(array)] = array
+    return bigger
+
+
+# Formatos de almacenamiento del encoding en la tabla personas (columna encoding_format)
+ENCODING_FORMATS = ('float64', 'float16', 'int8')
+
+
+def encode_encoding(encoding, fmt='float64'):
+    """
+    Serializa un encoding para el BLOB de la base.
+    float64: 1 KiB (formato original); float16: 256 bytes;
+    int8: escala float32 + 128 enteros (132 bytes).
+    """
+    vector = np.asarray(encoding, dtype=np.float64).reshape(ENCODING_SIZE)
+    if fmt == 'float64':
+        return vector.tobytes()
+    if fmt == 'float16':
+        return vector.astype(np.float16).tobytes()
+    if fmt == 'int8':
+        scale, q = quantize_int8(vector.reshape(1, -1))
+        return scale.astype(np.float32).tobytes() + q.tobytes()
+    raise ValueError(f"Formato de encoding desconocido: {fmt}")
+
+
+def decode_encoding(blob, fmt='float64'):
+    """Inversa de encode_encoding; devuelve un vector float32"""
+    if fmt is None or fmt == 'float64':
+        return np.frombuffer(blob, dtype=np.float64).astype(np.float32)
+    if fmt == 'float16':
+        return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+    if fmt == 'int8':
+        scale = np.frombuffer(blob[:4], dtype=np.float32)[0]
+        return np.frombuffer(blob[4:], dtype=np.int8).astype(np.float32) * scale
+    raise ValueError(f"Formato de encoding desconocido: {fmt}")
+
+
+def quantize_int8(matrix):
+    """Cuantiza cada fila a int8 con su propia escala (max |x| / 127)"""
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    q = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return scales.astype(np.float32), q
+
+
+class CompactStore:
+    """
+    Galería en int8 con una escala por fila, en lugar de la matriz float32:
+    ocupa 4 veces menos en memoria. Se recorre por bloques convertidos a
+    float32 para elegir candidatos; sus distancias llevan el error de la
+    cuantización, así que GalleryMatcher las recalcula con los float32 de la
+    caché. store[filas] devuelve las filas reconstruidas (fila * escala).
+    """
+
+    def __init__(self):
+        self.values = np.empty((0, ENCODING_SIZE), dtype=np.int8)
+        self.scales = np.empty((0,), dtype=np.float32)
+        self.sq_norms = np.empty((0,), dtype=np.float32)
+
+    def __getitem__(self, rows):
+        block = self.values[rows].astype(np.float32)
+        block *= self.scales[rows][..., None]
+        return block
+
+    def load(self, matrix, chunk=4096):
+        """Cuantiza `matrix` (p. ej. el memmap de la caché) por bloques, sin copiarla entera"""
+        n = len(matrix)
+        self.values = np.empty((n, ENCODING_SIZE), dtype=np.int8)
+        self.scales = np.empty(n, dtype=np.float32)
+        self.sq_norms = np.empty(n, dtype=np.float32)
+        for start in range(0, n, chunk):
+            end = min(start + chunk, n)
+            self.scales[start:end], self.values[start:end] = quantize_int8(
+                np.asarray(matrix[start:end], dtype=np.float32))
+            block = self[start:end]
+            self.sq_norms[start:end] = np.einsum('ij,ij->i', block, block)
+
+    def reserve(self, needed):
+        self.values = grow(self.values, needed)
+        self.scales = grow(self.scales, needed)
+        self.sq_norms = grow(self.sq_norms, needed)
+
+    def write_row(self, row, vector):
+        scale, q = quantize_int8(vector.reshape(1, -1))
+        self.values[row] = q[0]
+        self.scales[row] = scale[0]
+        approx = self[row]
+        self.sq_norms[row] = np.dot(approx, approx)
+
+    def move_row(self, src, dst):
+        self.values[dst] = self.values[src]
+        self.scales[dst] = self.scales[src]
+        self.sq_norms[dst] = self.sq_norms[src]
+
+    def shortlist(self, queries, size, k, chunk=2048):
+        """
+        (filas, distancias² aproximadas) de las k filas más cercanas a cada
+        consulta, recorriendo la galería por bloques convertidos a float32
+        """
+        # Como ||a||² es igual para todas las filas, se ordena por
+        # ||b||² - 2·escala·(a·q) y se suma ||a||² sólo a las k elegidas
+        scores = np.empty((len(queries), size), dtype=np.float32)
+        block = np.empty((chunk, ENCODING_SIZE), dtype=np.float32)
+        for start in range(0, size, chunk):
+            end = min(start + chunk, size)
+            rows = block[:end - start]
+            rows[...] = self.values[start:end]
+            dots = scores[:, start:end]
+            np.matmul(queries, rows.T, out=dots)
+            dots *= self.scales[start:end]
+            dots *= -2.0
+            dots += self.sq_norms[start:end]
+        k = min(k, size)
+        best = np.argpartition(scores, k - 1, axis=1)[:, :k]
+        d2 = np.take_along_axis(scores, best, axis=1)
+        d2 += np.einsum('ij,ij->i', queries, queries)[:, None]
+        np.maximum(d2, 0.0, out=d2)
+        return best, d2
+
+
+class IVFIndex:
+    """
+    Índice aproximado tipo IVF (inverted file): un k-means sobre la galería
+    reparte las filas en celdas; cada consulta sólo recorre las `nprobe`
+    celdas cuyos centroides están más cerca y luego recalcula la distancia
+    exacta de esos candidatos, así que la tolerancia conserva su significado.
+
+    Cada celda es un array con capacidad sobrante y cada fila recuerda su
+    celda y su posición, por lo que agregar, quitar o mover una fila es O(1)
+    (más la búsqueda del centroide más cercano al agregar).
+    """
+
+    def __init__(self, centroids, assign, checksum):
+        self.centroids = centroids
+        self.centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+        self.checksum = checksum
+
+        nlist = len(centroids)
+        order = np.argsort(assign, kind='stable').astype(np.int32)
+        self.counts = np.bincount(assign, minlength=nlist).astype(np.int64)
+        bounds = np.concatenate(([0], np.cumsum(self.counts)))
+        self.cells = [order[bounds[i]:bounds[i + 1]].copy() for i in range(nlist)]
+        self.row_cell = np.asarray(assign, dtype=np.int32).copy()
+        self.row_pos = np.empty(len(assign), dtype=np.int32)
+        self.row_pos[order] = np.arange(len(order)) - bounds[assign[order]]
+
+    @property
+    def size(self):
+        return int(self.counts.sum())
+
+    @classmethod
+    def build(cls, matrix, nlist=None, iterations=10, sample_size=None, seed=0):
+        """Entrena los centroides con k-means y asigna cada fila a su celda"""
+        n = len(matrix)
+        if nlist is None:
+            nlist = max(1, int(4 * np.sqrt(n)))
+        nlist = min(nlist, n)
+        rng = np.random.default_rng(seed)
+
+        # Entrenar sobre una muestra: ~40 puntos por centroide alcanzan
+        if sample_size is None:
+            sample_size = min(n, nlist * 40)
+        sample = matrix[rng.choice(n, size=sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, size=nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assign = cls._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist).astype(np.float32)
+            empty = counts == 0
+            centroids[~empty] = sums[~empty] / counts[~empty, None]
+            # Reubicar centroides vacíos en puntos aleatorios de la muestra
+            if empty.any():
+                centroids[empty] = sample[rng.choice(sample_size, size=int(empty.sum()), replace=False)]
+
+        return cls(centroids, cls._assign(matrix, centroids), matrix_checksum(matrix))
+
+    @staticmethod
+    def _assign(vectors, centroids, chunk=65536):
+        """Centroide más cercano de cada vector, por bloques para acotar memoria"""
+        c_norms = np.einsum('ij,ij->i', centroids, centroids)
+        assign = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk):
+            block = vectors[start:start + chunk]
+            assign[start:start + chunk] = np.argmin(squared_distances(block, centroids, c_norms), axis=1)
+        return assign
+
+    def add(self, row, vector):
+        """Agrega la fila `row` a la celda de su centroide más cercano"""
+        d2 = squared_distances(vector.reshape(1, -1), self.centroids, self.centroid_sq_norms)[0]
+        cell = int(np.argmin(d2))
+        pos = int(self.counts[cell])
+        self.cells[cell] = grow(self.cells[cell], pos + 1)
+        self.cells[cell][pos] = row
+        self.counts[cell] += 1
+        self.row_cell = grow(self.row_cell, row + 1)
+        self.row_pos = grow(self.row_pos, row + 1)
+        self.row_cell[row] = cell
+        self.row_pos[row] = pos
+
+    def remove(self, row):
+        """Quita la fila `row` de su celda (intercambiándola con la última)"""
+        cell = self.row_cell[row]
+        pos = self.row_pos[row]
+        last = self.counts[cell] - 1
+        moved = self.cells[cell][last]
+        self.cells[cell][pos] = moved
+        self.row_pos[moved] = pos
+        self.counts[cell] -= 1
+
+    def relabel(self, old_row, new_row):
+        """La fila old_row pasó a ocupar la posición new_row en la matriz"""
+        cell = self.row_cell[old_row]
+        pos = self.row_pos[old_row]
+        self.cells[cell][pos] = new_row
+        self.row_cell[new_row] = cell
+        self.row_pos[new_row] = pos
+
+    def search(self, queries, matrix, sq_norms, nprobe=16):
+        """
+        Devuelve (best_idx, best_dist) por consulta. Las distancias de los
+        candidatos son exactas; sólo el conjunto de candidatos es aproximado.
+        """
+        rows, d2 = self.search_k(queries, matrix, sq_norms, nprobe, 1)
+        return rows[:, 0], np.sqrt(d2[:, 0])
+
+    def search_k(self, queries, matrix, sq_norms, nprobe=16, k=1):
+        """
+        Devuelve (filas, distancias²) de forma (consultas x k) con los k
+        candidatos más cercanos de las celdas recorridas (-1/inf si faltan).
+        """
+        nprobe = min(nprobe, len(self.cells))
+        coarse = squared_distances(queries, self.centroids, self.centroid_sq_norms)
+        probes = np.argpartition(coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        dists = np.full((len(queries), k), np.inf, dtype=np.float32)
+        for q, cells in enumerate(probes):
+            candidates = np.concatenate([self.cells[c][:self.counts[c]] for c in cells])
+            if not len(candidates):
+                continue
+            d2 = squared_distances(queries[q:q + 1], matrix[candidates], sq_norms[candidates])[0]
+            top = min(k, len(candidates))
+            best = np.argpartition(d2, top - 1)[:top]
+            rows[q, :top] = candidates[best]
+            dists[q, :top] = d2[best]
+        return rows, dists
+
+    def save(self, path):
+        size = self.size
+        np.savez(path, centroids=self.centroids, assign=self.row_cell[:size],
+                 checksum=np.int64(self.checksum))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(f['centroids'], f['assign'].astype(np.int64), int(f['checksum']))
+
+
+class EncodingCache:
+    """
+    Copia de todos los encodings de la tabla personas en archivos .npy junto a
+    la base, para abrirlos al arrancar con np.load(mmap_mode='r') en lugar de
+    deserializar cada BLOB. Se guardan también sus normas al cuadrado (así no
+    hay que recorrer toda la matriz al cargar), la versión de la tabla (ver
+    personas_version) y los ids; si alguno no coincide, la caché está vieja.
+    """
+
+    def __init__(self, base_path):
+        self.matrix_path = base_path + '_encodings.npy'
+        self.norms_path = base_path + '_norms.npy'
+        self.ids_path = base_path + '_ids.npy'
+        self.meta_path = base_path + '_cache.json'
+
+    def meta(self):
+        if not os.path.exists(self.meta_path):
+            return None
+        with open(self.meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def load(self, version, ids):
+        """Devuelve (matriz, normas al cuadrado) mapeadas en memoria, o None si la caché no sirve"""
+        try:
+            meta = self.meta()
+            if meta is None or meta.get('version') != version or meta.get('count') != len(ids):
+                return None
+            cached_ids = np.load(self.ids_path, mmap_mode='r')
+            if not np.array_equal(cached_ids, np.asarray(ids, dtype=np.int64)):
+                return None
+            matrix = np.load(self.matrix_path, mmap_mode='r')
+            sq_norms = np.load(self.norms_path, mmap_mode='r')
+            if matrix.shape != (len(ids), ENCODING_SIZE) or matrix.dtype != np.float32:
+                return None
+            if sq_norms.shape != (len(ids),) or sq_norms.dtype != np.float32:
+                return None
+            return matrix, sq_norms
+        except Exception as e:
+            logging.error(f"Error al leer caché de encodings: {e}")
+            return None
+
+    def save(self, ids, matrix, version):
+        """Escribe la caché; los archivos se reemplazan al final para no dejarla a medias"""
+        try:
+            matrix = np.ascontiguousarray(matrix, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+            sq_norms = np.einsum('ij,ij->i', matrix, matrix)
+            self._replace(self.matrix_path, lambda f: np.save(f, matrix))
+            self._replace(self.norms_path, lambda f: np.save(f, sq_norms))
+            self._replace(self.ids_path, lambda f: np.save(f, np.asarray(ids, dtype=np.int64)))
+            self._write_meta(version, len(ids))
+        except Exception as e:
+            logging.error(f"Error al guardar caché de encodings: {e}")
+
+    def append(self, persona_id, encoding, version):
+        """
+        Agrega al final la persona recién guardada (su id es el mayor, como en
+        el orden de la carga) y pasa la caché a `version`, para que el próximo
+        arranque no la reconstruya desde la base. Solo si la caché estaba al día
+        con la versión anterior; si no, queda vieja y se reconstruye.
+        """
+        try:
+            meta = self.meta()
+            if meta is None or meta.get('version') != version - 1:
+                return False
+            vector = np.asarray(encoding, dtype=np.float32).reshape(1, ENCODING_SIZE)
+            ids = np.load(self.ids_path)
+            if len(ids) != meta.get('count') or (len(ids) and ids[-1] >= persona_id):
+                return False
+            self._append_rows(self.matrix_path, vector)
+            self._append_rows(self.norms_path, np.einsum('ij,ij->i', vector, vector))
+            self._replace(self.ids_path, lambda f: np.save(f, np.append(ids, np.int64(persona_id))))
+            self._write_meta(version, len(ids) + 1)
+            return True
+        except Exception as e:
+            logging.error(f"Error al actualizar caché de encodings: {e}")
+            return False
+
+    def _write_meta(self, version, count):
+        meta = json.dumps({'version': version, 'count': count}).encode('utf-8')
+        self._replace(self.meta_path, lambda f: f.write(meta))
+
+    @staticmethod
+    def _append_rows(path, rows, chunk=65536):
+        """Copia el .npy con `rows` agregadas al final, por bloques y sin cargarlo entero"""
+        tmp_path = path + '.tmp'
+        old = np.load(path, mmap_mode='r')
+        new = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=old.dtype,
+                                        shape=(len(old) + len(rows),) + old.shape[1:])
+        for start in range(0, len(old), chunk):
+            end = min(start + chunk, len(old))
+            new[start:end] = old[start:end]
+        new[len(old):] = rows
+        new.flush()
+        # Soltar ambos mapeos antes de reemplazar (en Windows no se puede con el archivo abierto)
+        del old, new
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _replace(path, write):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+
+class GalleryMatcher:
+    """
+    Mantiene todos los encodings conocidos en una única matriz float32 contigua
+    (una fila por persona) junto con sus normas al cuadrado precalculadas, para
+    comparar todas las caras de un frame contra toda la galería en una sola
+    operación matricial. Para galerías muy grandes puede usar un IVFIndex, y
+    con compact_format='int8' guarda la galería en un CompactStore en lugar
+    de la matriz float32: los `rerank` candidatos que elige el int8 se
+    re-ordenan con la distancia exacta contra la matriz float32 de la caché,
+    que queda mapeada en disco y de la que solo se leen esas filas.
+
+    La galería se puede modificar en el lugar (add/update/remove por id de
+    persona) sin recargar la base; cada cambio incrementa `generation` para
+    que otros hilos sepan que la galería cambió.
+
+    Una persona puede tener varias plantillas (set_templates/add_template):
+    su fila pasa a ser el centroide, que se usa como pre-filtro, y la
+    distancia final es la mínima entre sus plantillas.
+    """
+
+    def __init__(self, nprobe=16, compact_format=None, prefilter=5, rerank=32):
+        self.lock = threading.RLock()
+        # Personas con varias plantillas: su fila es el centroide y se revisan
+        # las plantillas sólo de las `prefilter` personas más cercanas
+        self.templates = {}  # id de persona -> matriz float32 (plantillas x 128)
+        self.prefilter = prefilter
+        # Galería compacta opcional: reemplaza a buffer/norm_buffer
+        if compact_format not in (None, 'int8'):
+            raise ValueError(f"Formato compacto desconocido: {compact_format}")
+        self.compact = CompactStore() if compact_format else None
+        self.rerank = rerank
+        self.buffer = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        self.norm_buffer = np.empty((0,), dtype=np.float32)
+        # Mientras `buffer` sea la matriz de solo lectura con que se cargó (el
+        # memmap de la caché; con la galería compacta, siempre) las filas que
+        # cambian van aquí, p. ej. los centroides de las personas con varias
+        # plantillas, en lugar de copiar toda la matriz a memoria
+        self.patches = {}  # fila -> vector float32
+        self.size = 0
+        self.data = []
+        self.rows = {}  # id de persona -> fila de la matriz
+        self.index = None
+        self.nprobe = nprobe
+        self.generation = 0
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, persona_id):
+        return persona_id in self.rows
+
+    @property
+    def matrix(self):
+        """
+        Matriz float32 de la galería (con la galería compacta se reconstruye
+        entera); no incluye las filas de `patches`
+        """
+        if self.compact is not None:
+            return self.compact[:self.size]
+        return self.buffer[:self.size]
+
+    @property
+    def sq_norms(self):
+        if self.compact is not None:
+            return self.compact.sq_norms[:self.size]
+        return self.norm_buffer[:self.size]
+
+    @property
+    def vectors(self):
+        """Filas indexables (vectors[filas]) sin reconstruir toda la galería compacta"""
+        return self.compact if self.compact is not None else self.matrix
+
+    def vector(self, row):
+        if self.compact is not None or self.patches:
+            return self._exact(np.array([row]))[0]
+        return self.buffer[row]
+
+    def load(self, encodings, data, templates=None, sq_norms=None):
+        """
+        Reemplaza la galería completa (y descarta el índice aproximado).
+        encodings: secuencia de vectores de 128 elementos (cualquier dtype)
+        data: lista de diccionarios (con clave 'id') alineada con encodings
+        templates: opcional, {id de persona: lista de encodings} para las
+        personas con más de una plantilla
+        sq_norms: opcional, normas al cuadrado ya calculadas (p. ej. de la
+        caché), para no recorrer toda la matriz al cargar
+        """
+        if self.compact is not None and isinstance(encodings, np.ndarray) and encodings.ndim == 2:
+            # La galería compacta se cuantiza directo del memmap: no queda copia float32
+            matrix = encodings
+        elif isinstance(encodings, np.ndarray) and encodings.ndim == 2 and not encodings.flags.writeable:
+            # Sin copiar: memmap de solo lectura (ver EncodingCache), se copia al editarlo
+            matrix = np.ascontiguousarray(encodings, dtype=np.float32)
+        elif isinstance(encodings, np.ndarray) and encodings.ndim == 2:
+            matrix = np.array(encodings, dtype=np.float32, order='C')
+        elif len(encodings):
+            matrix = np.ascontiguousarray(np.vstack(encodings), dtype=np.float32)
+        else:
+            matrix = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        if self.compact is not None:
+            sq_norms = None  # la galería compacta calcula las de sus vectores cuantizados
+        elif sq_norms is None or len(sq_norms) != len(matrix):
+            sq_norms = np.einsum('ij,ij->i', matrix, matrix)
+        else:
+            sq_norms = np.asarray(sq_norms, dtype=np.float32)
+        with self.lock:
+            if self.compact is not None:
+                self.compact.load(matrix)
+                self.buffer = matrix  # solo para re-ordenar los candidatos
+                self.norm_buffer = np.empty((0,), dtype=np.float32)
+            else:
+                self.buffer = matrix
+                self.norm_buffer = sq_norms
+            self.size = len(matrix)
+            self.data = list(data)
+            self.rows = {d['id']: i for i, d in enumerate(self.data)}
+            self.patches = {}
+            self.templates = {}
+            self.index = None
+            for persona_id, encodings_list in (templates or {}).items():
+                self.set_templates(persona_id, encodings_list)
+            self.generation += 1
+
+    def add(self, persona_id, encoding, face_data):
+        """Agrega una persona al final de la galería (O(1) amortizado)"""
+        with self.lock:
+            if persona_id in self.rows:
+                return self.update(persona_id, encoding, face_data)
+            row = self.size
+            if self.compact is not None:
+                self.compact.reserve(row + 1)
+            else:
+                if row >= len(self.buffer):
+                    # Agrandar copia la matriz a memoria propia (también la de la caché)
+                    self.buffer = grow(self.buffer, row + 1)
+                    self.norm_buffer = grow(self.norm_buffer, row + 1)
+                    self._ensure_writable()
+            self._write_row(row, encoding)
+            self.data.append(face_data)
+            self.rows[persona_id] = row
+            self.size += 1
+            if self.index is not None:
+                self.index.add(row, self.vector(row))
+            self.generation += 1
+            return True
+
+    def update(self, persona_id, encoding=None, face_data=None):
+        """
+        Reemplaza el encoding y/o los datos de una persona ya cargada.
+        Un encoding nuevo reemplaza también todas sus plantillas.
+        """
+        with self.lock:
+            row = self.rows.get(persona_id)
+            if row is None:
+                return False
+            if encoding is not None:
+                self.templates.pop(persona_id, None)
+                self._replace_row(row, encoding)
+            if face_data is not None:
+                self.data[row] = face_data
+            self.generation += 1
+            return True
+
+    def set_templates(self, persona_id, encodings):
+        """Reemplaza las plantillas de una persona; su fila pasa a ser el centroide"""
+        with self.lock:
+            row = self.rows.get(persona_id)
+            if row is None:
+                return False
+            stack = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+            if len(stack) > 1:
+                self.templates[persona_id] = stack
+            else:
+                self.templates.pop(persona_id, None)
+            self._replace_row(row, stack.mean(axis=0))
+            self.generation += 1
+            return True
+
+    def add_template(self, persona_id, encoding):
+        """Agrega una plantilla a una persona (la primera es su fila actual)"""
+        with self.lock:
+            row = self.rows.get(persona_id)
+            if row is None:
+                return False
+            current = self.templates.get(persona_id)
+            if current is None:
+                current = self.vector(row).reshape(1, ENCODING_SIZE)
+            vector = np.asarray(encoding, dtype=np.float32).reshape(1, ENCODING_SIZE)
+            return self.set_templates(persona_id, np.vstack((current, vector)))
+
+    def remove(self, persona_id):
+        """Quita una persona moviendo la última fila a su lugar (O(1))"""
+        with self.lock:
+            row = self.rows.pop(persona_id, None)
+            if row is None:
+                return False
+            self.templates.pop(persona_id, None)
+            last = self.size - 1
+            if self.index is not None:
+                self.index.remove(row)
+            if row != last:
+                if self.compact is not None:
+                    self.compact.move_row(last, row)
+                if self.compact is not None or not self.buffer.flags.writeable:
+                    self.patches[row] = np.array(self.vector(last))
+                else:
+                    self.buffer[row] = self.buffer[last]
+                    self.norm_buffer[row] = self.norm_buffer[last]
+                self.data[row] = self.data[last]
+                self.rows[self.data[row]['id']] = row
+                if self.index is not None:
+                    self.index.relabel(last, row)
+            self.patches.pop(last, None)
+            self.data.pop()
+            self.size -= 1
+            self.generation += 1
+            return True
+
+    def _replace_row(self, row, encoding):
+        self._write_row(row, encoding)
+        if self.index is not None:
+            self.index.remove(row)
+            self.index.add(row, self.vector(row))
+
+    def _ensure_writable(self):
+        """
+        Copia a memoria propia la matriz y las normas si todavía apuntan a la
+        caché de solo lectura y les pasa las filas cambiadas
+        """
+        if not self.buffer.flags.writeable:
+            self.buffer = np.array(self.buffer)
+        if not self.norm_buffer.flags.writeable:
+            self.norm_buffer = np.array(self.norm_buffer)
+        for row, vector in self.patches.items():
+            self.buffer[row] = vector
+            self.norm_buffer[row] = np.dot(vector, vector)
+        self.patches = {}
+
+    def _write_row(self, row, encoding):
+        vector = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_SIZE)
+        if self.compact is not None:
+            self.compact.write_row(row, vector)
+        if self.compact is not None or not self.buffer.flags.writeable:
+            self.patches[row] = vector
+            return
+        self.buffer[row] = vector
+        self.norm_buffer[row] = np.dot(vector, vector)
+
+    def enable_index(self, index_path=None, nlist=None):
+        """
+        Activa la búsqueda aproximada. Si hay un índice guardado en index_path
+        que corresponde a la galería actual se reutiliza; si no, se entrena
+        uno nuevo y se guarda para el próximo arranque.
+        """
+        with self.lock:
+            matrix = self.matrix.copy()
+            for row, vector in self.patches.items():
+                matrix[row] = vector
+            generation = self.generation
+        if not len(matrix):
+            return
+        checksum = matrix_checksum(matrix)
+        index = None
+        if index_path and os.path.exists(index_path):
+            try:
+                index = IVFIndex.load(index_path)
+                if index.size != len(matrix) or index.checksum != checksum:
+                    logging.info("Índice aproximado desactualizado, se reconstruye")
+                    index = None
+            except Exception as e:
+                logging.error(f"Error al cargar índice aproximado: {e}")
+                index = None
+
+        if index is None:
+            start = time.time()
+            index = IVFIndex.build(matrix, nlist=nlist)
+            logging.info(f"Índice aproximado construido: {len(index.cells)} listas en {time.time() - start:.1f}s")
+            if index_path:
+                try:
+                    index.save(index_path)
+                except Exception as e:
+                    logging.error(f"Error al guardar índice aproximado: {e}")
+
+        with self.lock:
+            if self.generation == generation:  # la galería no cambió mientras se construía
+                self.index = index
+
+    def _shortlist(self, queries, k):
+        """
+        Devuelve (filas, distancias²) de forma (consultas x k): las k filas más
+        cercanas a cada consulta con su distancia exacta a esa fila. Usa el
+        índice aproximado, la copia compacta o el recorrido exhaustivo.
+        """
+        k = min(k, self.size)
+        if self.compact is None and self.index is None:
+            d2 = squared_distances(queries, self.matrix, self.sq_norms)
+            if self.patches:
+                # Filas cambiadas sobre el memmap de la caché: se recalculan sus columnas
+                rows = np.fromiter(self.patches, dtype=np.int64, count=len(self.patches))
+                patched = np.stack(list(self.patches.values()))
+                d2[:, rows] = squared_distances(queries, patched, np.einsum('ij,ij->i', patched, patched))
+            best = np.argpartition(d2, k - 1, axis=1)[:, :k]
+            return best, np.take_along_axis(d2, best, axis=1)
+        if self.compact is None and not self.patches:
+            return self.index.search_k(queries, self.vectors, self.sq_norms, self.nprobe, k)
+        # Galería compacta (o índice con filas cambiadas fuera de la matriz):
+        # solo se eligen candidatos, más de k porque el error del int8 alcanza
+        # para invertir el orden cerca de la tolerancia, y la distancia final
+        # sale de los float32
+        size = min(self.size, max(k, self.rerank))
+        if self.index is not None:
+            rows, _ = self.index.search_k(queries, self.vectors, self.sq_norms, self.nprobe, size)
+        else:
+            rows, _ = self.compact.shortlist(queries, self.size, size)
+        d2 = self._exact_distances(queries, rows)
+        if size > k:
+            best = np.argpartition(d2, k - 1, axis=1)[:, :k]
+            rows = np.take_along_axis(rows, best, axis=1)
+            d2 = np.take_along_axis(d2, best, axis=1)
+        return rows, d2
+
+    def _exact(self, rows):
+        """Vectores float32 de `rows` (cualquier forma) desde la matriz cargada y las filas cambiadas"""
+        flat = np.asarray(rows, dtype=np.int64).ravel()
+        vectors = np.empty((len(flat), ENCODING_SIZE), dtype=np.float32)
+        loaded = flat < len(self.buffer)
+        vectors[loaded] = self.buffer[flat[loaded]]
+        if self.patches:
+            for i, row in enumerate(flat.tolist()):
+                patch = self.patches.get(row)
+                if patch is not None:
+                    vectors[i] = patch
+        return vectors.reshape(np.shape(rows) + (ENCODING_SIZE,))
+
+    def _exact_distances(self, queries, rows):
+        """Distancias² exactas (consultas x candidatos); inf donde la fila es -1"""
+        valid = rows >= 0
+        diff = self._exact(np.where(valid, rows, 0)) - queries[:, None, :]
+        d2 = np.einsum('qcd,qcd->qc', diff, diff)
+        d2[~valid] = np.inf
+        return d2
+
+    def _ranked(self, queries, k):
+        """
+        Devuelve (filas, distancias) de forma (consultas x k) ordenadas de menor
+        a mayor. Si hay personas con varias plantillas, se pre-filtran las
+        `prefilter` más cercanas por centroide y cada una toma la mínima
+        distancia a sus plantillas. Sólo se ordenan los k finales (el resto es
+        una selección parcial con argpartition).
+        """
+        shortlist = max(k, self.prefilter) if self.templates else k
+        rows, d2 = self._shortlist(queries, shortlist)
+        dists = np.sqrt(d2)
+        if self.templates:
+            for q, candidates in enumerate(rows.tolist()):
+                for j, row in enumerate(candidates):
+                    if row < 0:
+                        continue
+                    stack = self.templates.get(self.data[row]['id'])
+                    if stack is not None:
+                        dists[q, j] = np.sqrt(np.min(np.sum((stack - queries[q]) ** 2, axis=1)))
+        k = min(k, dists.shape[1])
+        if dists.shape[1] > k:
+            part = np.argpartition(dists, k - 1, axis=1)[:, :k]
+            rows = np.take_along_axis(rows, part, axis=1)
+            dists = np.take_along_axis(dists, part, axis=1)
+        order = np.argsort(dists, axis=1)
+        return np.take_along_axis(rows, order, axis=1), np.take_along_axis(dists, order, axis=1)
+
+    def nearest(self, face_encodings):
+        """
+        Devuelve (best_idx, best_dist, datos) para un lote de encodings.
+        datos tiene el diccionario de la persona más cercana de cada cara.
+        """
+        queries = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        with self.lock:
+            rows, dists = self._ranked(queries, 1)
+            best_idx = rows[:, 0]
+            best_dist = dists[:, 0]
+            data = [self.data[i] if i >= 0 else None for i in best_idx.tolist()]
+        return best_idx, best_dist, data
+
+    def top_k(self, face_encodings, k=3):
+        """
+        Devuelve, por cada cara, (candidatos, margen): candidatos es una lista
+        de hasta k tuplas (face_data, distancia) de menor a mayor distancia y
+        margen es la diferencia entre el segundo y el primero (inf si hay uno
+        solo). Un margen chico indica una coincidencia ambigua.
+        """
+        if len(face_encodings) == 0:
+            return []
+        if not len(self):
+            return [([], float('inf')) for _ in range(len(face_encodings))]
+        queries = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        with self.lock:
+            rows, dists = self._ranked(queries, k)
+            results = []
+            for row_list, dist_list in zip(rows.tolist(), dists.tolist()):
+                candidates = [(self.data[r], d) for r, d in zip(row_list, dist_list) if r >= 0]
+                margin = candidates[1][1] - candidates[0][1] if len(candidates) > 1 else float('inf')
+                results.append((candidates, margin))
+        return results
+
+    def match(self, face_encodings, tolerance=0.5):
+        """
+        Compara un lote de encodings contra la galería.
+        Devuelve una lista con (face_data, distancia) por cada cara: la persona
+        más cercana si está dentro de la tolerancia, o (None, distancia) si no.
+        """
+        if len(face_encodings) == 0:
+            return []
+        if not len(self):
+            return [(None, float('inf')) for _ in range(len(face_encodings))]
+
+        _, best_dist, data = self.nearest(face_encodings)
+        results = []
+        for face_data, dist in zip(data, best_dist.tolist()):
+            if face_data is not None and dist <= tolerance:
+                results.append((face_data, dist))
+            else:
+                results.append((None, dist))
+        return results
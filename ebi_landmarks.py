@@ -0,0 +1,116 @@
+# Landmarks faciales reutilizando la caja de la cara entre frames
+import face_recognition
+import numpy as np
+
+
+def eye_centers(landmarks):
+    """Centros (x, y) de ambos ojos, o None si faltan los puntos"""
+    left, right = landmarks.get('left_eye'), landmarks.get('right_eye')
+    if not left or not right:
+        return None
+    return np.mean(left, axis=0), np.mean(right, axis=0)
+
+
+def plausible_landmarks(landmarks, box, eye_ratio=(0.2, 0.7)):
+    """
+    Los ojos caen en la parte superior central de la caja y a una distancia
+    acorde a su ancho (`eye_ratio`); si no, la caja no contiene la cara.
+    """
+    eyes = eye_centers(landmarks) if landmarks else None
+    if eyes is None:
+        return False
+    top, right, bottom, left = box
+    width, height = max(1, right - left), max(1, bottom - top)
+    (lx, ly), (rx, ry) = eyes
+    ratio = np.hypot(rx - lx, ry - ly) / width
+    mid_x, mid_y = (lx + rx) / 2.0, (ly + ry) / 2.0
+    return (eye_ratio[0] <= ratio <= eye_ratio[1]
+            and left + 0.25 * width <= mid_x <= right - 0.25 * width
+            and top <= mid_y <= top + 0.6 * height)
+
+
+def landmarks_for_boxes(rgb, boxes, model='large', eye_ratio=(0.2, 0.7)):
+    """
+    Landmarks de cada caja ya conocida (p. ej. las de los tracks de la
+    detección en vivo), sin detectar caras; None para las cajas donde los
+    ojos no son plausibles.
+    """
+    if not boxes:
+        return []
+    landmarks = face_recognition.face_landmarks(rgb, boxes, model=model)
+    return [points if plausible_landmarks(points, box, eye_ratio) else None
+            for points, box in zip(landmarks, boxes)]
+
+
+class FaceLandmarker:
+    """
+    Landmarks de una cara a lo largo de frames sucesivos sin correr el
+    detector en cada uno: la caja del frame anterior se usa como
+    known_face_locations.
+    Si los ojos resultantes no son plausibles para esa caja (la cara se fue o
+    se movió demasiado) se detecta de nuevo en el frame completo; también
+    cada `redetect_every` frames, para no arrastrar una caja que se desvió.
+    """
+
+    def __init__(self, detector=None, model='large', redetect_every=30, eye_ratio=(0.2, 0.7)):
+        self.detector = detector  # FaceDetector para la detección completa (por defecto HOG)
+        self.model = model
+        self.redetect_every = redetect_every
+        self.eye_ratio = eye_ratio  # distancia entre ojos relativa al ancho de la caja
+        self.reset()
+
+    def reset(self):
+        self.box = None
+        self.anchor = None  # punto medio de los ojos relativo a la caja, medido al detectar
+        self.since_detection = 0
+
+    def detect(self, rgb):
+        """Detección completa: la cara más grande del frame, o None"""
+        boxes = self.detector.locate(rgb) if self.detector is not None else face_recognition.face_locations(rgb)
+        if not boxes:
+            return None
+        return max(boxes, key=lambda b: (b[2] - b[0]) * (b[1] - b[3]))
+
+    def follow(self, box, landmarks, shape, detected):
+        """Caja para el próximo frame: la misma, desplazada con el punto medio de los ojos"""
+        eyes = eye_centers(landmarks)
+        if eyes is None:
+            return box
+        top, right, bottom, left = box
+        width, height = right - left, bottom - top
+        mid = (eyes[0] + eyes[1]) / 2.0
+        if detected or self.anchor is None:
+            self.anchor = ((mid[0] - left) / max(1, width), (mid[1] - top) / max(1, height))
+            return box
+        left = int(round(mid[0] - self.anchor[0] * width))
+        top = int(round(mid[1] - self.anchor[1] * height))
+        img_h, img_w = shape[:2]
+        left = min(max(0, left), max(0, img_w - width))
+        top = min(max(0, top), max(0, img_h - height))
+        return (top, left + width, top + height, left)
+
+    def landmarks(self, rgb):
+        """Landmarks de la cara en `rgb` (dict de face_recognition) o None si no hay cara"""
+        box = self.box if self.since_detection < self.redetect_every else None
+        detected = box is None
+        if detected:
+            box = self.detect(rgb)
+            if box is None:
+                self.reset()
+                return None
+
+        landmarks = face_recognition.face_landmarks(rgb, [box], model=self.model)[0]
+        if not detected and not plausible_landmarks(landmarks, box, self.eye_ratio):
+            # Caja perdida: detección completa en este mismo frame
+            detected = True
+            box = self.detect(rgb)
+            if box is None:
+                self.reset()
+                return None
+            landmarks = face_recognition.face_landmarks(rgb, [box], model=self.model)[0]
+        if detected:
+            self.since_detection = 0
+        else:
+            self.since_detection += 1
+        self.box = self.follow(box, landmarks, rgb.shape, detected)
+        return landmarks
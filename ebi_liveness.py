@@ -0,0 +1,217 @@
+# Prueba de vida por parpadeo (EAR) calculada a medida que llegan los frames
+import threading
+import time
+from math import hypot
+
+import cv2
+import numpy as np
+
+from ebi_capture import FrameRing
+from ebi_landmarks import FaceLandmarker
+from ebi_pipeline import DROP_OLDEST, Pipeline, Stage
+
+
+def eye_aspect_ratio(eye):
+    """
+    eye: lista de puntos (x,y) del ojo en el orden que devuelve face_recognition
+    Calcula la relación A+B / (2*C)
+    """
+    A = hypot(eye[1][0] - eye[5][0], eye[1][1] - eye[5][1])
+    B = hypot(eye[2][0] - eye[4][0], eye[2][1] - eye[4][1])
+    C = hypot(eye[0][0] - eye[3][0], eye[0][1] - eye[3][1])
+    if C == 0:
+        return 0.0
+    return (A + B) / (2.0 * C)
+
+
+class BlinkDetector:
+    """
+    Máquina de estados del EAR actualizada frame por frame: cuenta un
+    parpadeo cuando el EAR queda bajo `ear_threshold` durante al menos
+    `consec_frames` frames seguidos y vuelve a subir. update() recibe frames
+    RGB ya reducidos; la cara se detecta solo cuando se pierde su caja.
+    """
+
+    def __init__(self, detector=None, ear_threshold=0.23, consec_frames=2):
+        self.landmarker = FaceLandmarker(detector)  # detector para ubicar la cara (por defecto HOG)
+        self.ear_threshold = ear_threshold
+        self.consec_frames = consec_frames
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.landmarker.reset()
+        self.consec = 0
+        self.blinks = 0
+        self.frames = 0
+        self.face_frames = 0  # frames en los que se encontraron los ojos
+
+    def update(self, rgb):
+        lm = self.landmarker.landmarks(rgb)
+        with self.lock:
+            self.frames += 1
+            left = right = None
+            if lm:
+                left = lm.get('left_eye')
+                right = lm.get('right_eye')
+            if not (left and right and len(left) >= 6 and len(right) >= 6):
+                self.consec = 0
+                return
+            self.face_frames += 1
+            ear = (eye_aspect_ratio(left) + eye_aspect_ratio(right)) / 2.0
+            if ear < self.ear_threshold:
+                self.consec += 1
+            else:
+                if self.consec >= self.consec_frames:
+                    self.blinks += 1
+                self.consec = 0
+
+    def verdict(self):
+        """(frames con cara, hubo parpadeo); cuenta también un parpadeo que sigue en curso"""
+        with self.lock:
+            return self.face_frames, self.blinks >= 1 or self.consec >= self.consec_frames
+
+
+class BlinkMonitor:
+    """
+    Corre un BlinkDetector en su propio hilo mientras la vista previa le
+    entrega frames con feed(), sin bloquear la interfaz. Cada frame se escribe
+    reducido a `scale` (RGB, o en grises con `gray`) directamente en un
+    FrameRing preasignado, sin crear arrays por frame; el hilo del detector
+    recibe solo el número de secuencia y lee el slot sin copiarlo. Si el
+    detector está ocupado se descarta el frame más viejo. Al terminar la
+    cuenta regresiva stop() devuelve el veredicto ya calculado.
+    """
+
+    def __init__(self, detector=None, scale=0.5, gray=False, ear_threshold=0.23, consec_frames=2,
+                 maxsize=4, slots=16):
+        self.scale = scale
+        # En grises dlib (HOG/CNN) ubica la cara igual; Haar y DNN necesitan RGB
+        self.gray = gray
+        self.ring = FrameRing(slots, (0, 0) if gray else (0, 0, 3))
+        self.scratch = None  # frame BGR reducido, antes de convertir al slot
+        self.blink = BlinkDetector(detector, ear_threshold, consec_frames)
+        self.pipeline = Pipeline([Stage('parpadeo', self.process, maxsize=maxsize, policy=DROP_OLDEST)])
+
+    def process(self, seq, emit):
+        image = self.ring.view(seq)
+        if image is None:
+            return  # el slot ya se reutilizó: hay frames más nuevos en la cola
+        try:
+            self.blink.update(image)
+        except Exception:
+            # si falla un frame, lo ignoramos
+            with self.blink.lock:
+                self.blink.consec = 0
+
+    def start(self):
+        self.blink.reset()
+        self.pipeline.start()
+
+    def feed(self, frame):
+        """Entrega un frame BGR de la cámara (se copia reducido; el original puede reutilizarse)"""
+        height, width = frame.shape[:2]
+        size = (max(1, int(width * self.scale)), max(1, int(height * self.scale)))
+        if self.scratch is None or self.scratch.shape[:2] != (size[1], size[0]):
+            # Solo al primer frame o si cambia la resolución de la cámara
+            self.scratch = np.empty((size[1], size[0], 3), dtype=np.uint8)
+            self.ring.reshape((size[1], size[0]) if self.gray else (size[1], size[0], 3))
+        cv2.resize(frame, size, dst=self.scratch, interpolation=cv2.INTER_AREA)
+        code = cv2.COLOR_BGR2GRAY if self.gray else cv2.COLOR_BGR2RGB
+        cv2.cvtColor(self.scratch, code, dst=self.ring.write_slot())
+        self.ring.publish(time.time())
+        self.pipeline.submit(self.ring.seq)
+
+    def stop(self, timeout=0.5):
+        """Detiene el hilo y devuelve (frames con cara, hubo parpadeo)"""
+        self.pipeline.stop(timeout)
+        return self.blink.verdict()
+
+
+def landmark_points(landmarks):
+    """Todos los puntos de un dict de landmarks como matriz (N, 2), en orden fijo"""
+    return np.array([p for name in sorted(landmarks) for p in landmarks[name]], dtype=np.float64)
+
+
+def nonrigid_motion(previous, current):
+    """
+    Movimiento de los landmarks entre dos frames que no se explica por un
+    movimiento rígido de la cara (traslación, rotación y escala, alineadas
+    por Procrustes): error cuadrático medio por punto, en píxeles del frame.
+    Una foto impresa que se mueve entera da solo el ruido de los landmarks
+    (unos 2 px con 1 px de ruido por coordenada, sea la cara chica o
+    grande); una cara real gesticula.
+    """
+    a = previous - previous.mean(axis=0)
+    b = current - current.mean(axis=0)
+    sq_norm_a = np.sum(a ** 2)
+    if sq_norm_a == 0:
+        return 0.0
+    u, s, vt = np.linalg.svd(a.T @ b)
+    residual = b - (s.sum() / sq_norm_a) * (a @ u @ vt)
+    return float(np.sqrt(np.sum(residual ** 2) / len(residual)))
+
+
+class TrackLiveness:
+    """
+    Prueba de vida continua de un track durante la detección en vivo, a partir
+    de los landmarks que ya se calculan para cada cara seguida: parpadeos por
+    EAR y micro-movimiento no rígido de los landmarks (promedio móvil, en
+    píxeles). state() da 'vivo' con un parpadeo o con movimiento por encima
+    de `live_motion`, que tiene que quedar bien arriba del ruido de los
+    landmarks; 'sospechoso' si durante `min_seconds` segundos (más que el
+    intervalo habitual entre dos parpadeos) y al menos `min_frames` frames no
+    hubo ninguno de los dos (p. ej. una foto), e 'indeterminado' mientras tanto.
+    """
+
+    def __init__(self, ear_threshold=0.23, consec_frames=1, min_frames=8, min_seconds=10.0,
+                 live_motion=3.5, alpha=0.3):
+        self.ear_threshold = ear_threshold
+        self.consec_frames = consec_frames  # la detección en vivo ve menos frames por parpadeo
+        self.min_frames = min_frames
+        self.min_seconds = min_seconds
+        self.live_motion = live_motion
+        self.alpha = alpha
+        self.consec = 0
+        self.blinks = 0
+        self.frames = 0
+        self.motion = 0.0
+        self.previous = None
+        self.first_seen = None
+        self.last_seen = None
+
+    def update(self, landmarks, timestamp):
+        left, right = landmarks.get('left_eye'), landmarks.get('right_eye')
+        if left and right and len(left) >= 6 and len(right) >= 6:
+            ear = (eye_aspect_ratio(left) + eye_aspect_ratio(right)) / 2.0
+            if ear < self.ear_threshold:
+                self.consec += 1
+            else:
+                if self.consec >= self.consec_frames:
+                    self.blinks += 1
+                self.consec = 0
+
+        points = landmark_points(landmarks)
+        if self.previous is not None and self.previous.shape == points.shape:
+            motion = nonrigid_motion(self.previous, points)
+            self.motion = motion if self.frames == 1 else (1 - self.alpha) * self.motion + self.alpha * motion
+        self.previous = points
+        self.frames += 1
+        if self.first_seen is None:
+            self.first_seen = timestamp
+        self.last_seen = timestamp
+
+    def score(self):
+        """1.0 con un parpadeo visto; si no, el movimiento no rígido relativo al umbral de vida"""
+        if self.blinks:
+            return 1.0
+        return min(1.0, self.motion / self.live_motion) if self.live_motion else 0.0
+
+    def state(self):
+        """(estado, puntaje) con estado 'vivo', 'sospechoso' o 'indeterminado'"""
+        score = self.score()
+        if score >= 1.0:
+            return 'vivo', score
+        if self.frames >= self.min_frames and self.last_seen - self.first_seen >= self.min_seconds:
+            return 'sospechoso', score
+        return 'indeterminado', score
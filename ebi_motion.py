@@ -0,0 +1,95 @@
+# Compuerta de movimiento: evita correr el detector de rostros sobre una escena quieta
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """
+    Fondo de promedio móvil sobre una versión diminuta en grises del frame.
+    regions() compara el frame contra el fondo y devuelve las cajas
+    (top, right, bottom, left) con movimiento en coordenadas del frame
+    recibido, ya unidas y con margen; lista vacía si nada cambió.
+    """
+
+    def __init__(self, width=80, alpha=0.1, threshold=25, min_area=0.002, margin=0.5, full_frame=0.6):
+        self.width = width
+        self.alpha = alpha  # velocidad con que el fondo absorbe los cambios
+        self.threshold = threshold  # diferencia de gris que cuenta como movimiento
+        self.min_area = min_area  # fracción mínima del frame para considerar una región
+        self.margin = margin  # margen agregado a cada región, relativo a su tamaño
+        self.full_frame = full_frame  # si el movimiento cubre más que esto, usar el frame entero
+        self.background = None
+
+    def reset(self):
+        self.background = None
+
+    def regions(self, frame):
+        height, width = frame.shape[:2]
+        scale = width / float(self.width)
+        tiny = cv2.resize(frame, (self.width, max(1, int(round(height / scale)))), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(tiny, cv2.COLOR_BGR2GRAY), (5, 5), 0).astype(np.float32)
+
+        if self.background is None or self.background.shape != gray.shape:
+            # Sin fondo todavía: todo el frame es candidato
+            self.background = gray
+            return [(0, width, height, 0)]
+
+        diff = cv2.absdiff(gray, self.background)
+        cv2.accumulateWeighted(gray, self.background, self.alpha)
+        mask = cv2.dilate((diff > self.threshold).astype(np.uint8), None, iterations=2)
+
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        min_pixels = self.min_area * mask.size
+        boxes = [cv2.boundingRect(c) for c in contours if cv2.contourArea(c) >= min_pixels]
+        if not boxes:
+            return []
+
+        regions = []
+        for x, y, w, h in boxes:
+            pad_x, pad_y = w * self.margin, h * self.margin
+            regions.append((max(0, int((y - pad_y) * scale)), min(width, int((x + w + pad_x) * scale)),
+                            min(height, int((y + h + pad_y) * scale)), max(0, int((x - pad_x) * scale))))
+        regions = merge_boxes(regions)
+        covered = sum((r - l) * (b - t) for t, r, b, l in regions)
+        if covered > self.full_frame * width * height:
+            return [(0, width, height, 0)]
+        return regions
+
+
+def merge_boxes(boxes):
+    """Une las cajas (top, right, bottom, left) que se solapan"""
+    boxes = list(boxes)
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        while boxes:
+            top, right, bottom, left = boxes.pop()
+            for i, (t, r, b, l) in enumerate(boxes):
+                if left < r and l < right and top < b and t < bottom:
+                    boxes[i] = (min(top, t), max(right, r), max(bottom, b), min(left, l))
+                    merged = True
+                    break
+            else:
+                result.append((top, right, bottom, left))
+        boxes = result
+    return boxes
+
+
+def locate_in_regions(image, regions, locate):
+    """
+    Corre `locate(recorte)` solo sobre cada región y devuelve las cajas en
+    coordenadas de `image`, sin duplicados de caras que caigan en dos regiones.
+    """
+    height, width = image.shape[:2]
+    if len(regions) == 1 and regions[0] == (0, width, height, 0):
+        return locate(image)
+    locations = []
+    for top, right, bottom, left in regions:
+        if bottom <= top or right <= left:
+            continue
+        for t, r, b, l in locate(np.ascontiguousarray(image[top:bottom, left:right])):
+            box = (t + top, r + left, b + top, l + left)
+            if not any(box[3] < o[1] and o[3] < box[1] and box[0] < o[2] and o[0] < box[2] for o in locations):
+                locations.append(box)
+    return locations
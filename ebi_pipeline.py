@@ -0,0 +1,224 @@
+# Pipeline de detección de EBI: etapas en hilos separados unidas por colas acotadas
+import logging
+import queue
+import threading
+import time
+
+# Políticas de las colas entre etapas
+DROP_OLDEST = 'newest-wins'  # si está llena se descarta el elemento más viejo (frames)
+BLOCK = 'never-drop'  # si está llena el productor espera (detecciones)
+
+
+class StageQueue:
+    """
+    Cola acotada con una política explícita para cuando está llena:
+    DROP_OLDEST descarta el elemento más viejo para que siempre se procese lo
+    más reciente; BLOCK hace esperar al productor (contrapresión) y nunca pierde
+    elementos.
+    """
+
+    def __init__(self, maxsize, policy):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.policy = policy
+        self.dropped = 0
+
+    def put(self, item, stop_event=None):
+        if self.policy == DROP_OLDEST:
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    return True
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+        # BLOCK: esperar lugar; sólo si se pidió detener y la cola no se vacía
+        # en un tiempo prudencial se descarta (y se registra)
+        deadline = None
+        while True:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                if stop_event is None or not stop_event.is_set():
+                    continue
+                if deadline is None:
+                    deadline = time.time() + 2.0
+                elif time.time() > deadline:
+                    logging.warning("Pipeline detenido con la cola llena, elemento descartado")
+                    self.dropped += 1
+                    return False
+
+    def get(self, timeout=0.1):
+        return self.queue.get(timeout=timeout)
+
+    def depth(self):
+        return self.queue.qsize()
+
+
+class Stage:
+    """
+    Una etapa del pipeline: un hilo toma elementos de su cola de entrada y
+    llama a func(item, emit), donde emit(resultado) los pasa a la cola de
+    salida. Una etapa puede emitir cero, uno o varios resultados por elemento.
+    """
+
+    def __init__(self, name, func, maxsize=1, policy=BLOCK):
+        self.name = name
+        self.func = func
+        self.input = StageQueue(maxsize, policy)
+        self.output = None  # Stage siguiente
+        self.thread = None
+        self.stop_event = None
+        self.processed = 0
+        self.busy_time = 0.0
+        self.latency = 0.0  # Promedio móvil del tiempo por elemento (segundos)
+        self.idle = threading.Event()  # Sin elementos pendientes ni en proceso
+        self.idle.set()
+
+    def emit(self, item):
+        if self.output is not None:
+            self.output.input.put(item, self.stop_event)
+
+    def run(self, stop_event):
+        self.stop_event = stop_event
+        # Al detener, las colas que nunca descartan se vacían antes de salir
+        while not (stop_event.is_set() and (self.input.policy == DROP_OLDEST or self.input.depth() == 0)):
+            try:
+                item = self.input.get()
+            except queue.Empty:
+                continue
+            self.idle.clear()
+            start = time.perf_counter()
+            try:
+                self.func(item, self.emit)
+            except Exception as e:
+                logging.error(f"Error en etapa '{self.name}': {e}")
+            elapsed = time.perf_counter() - start
+            self.busy_time += elapsed
+            self.latency = elapsed if not self.processed else 0.8 * self.latency + 0.2 * elapsed
+            self.processed += 1
+            if self.input.depth() == 0:
+                self.idle.set()
+
+
+class Pipeline:
+    """
+    Cadena de etapas. submit() entrega un elemento a la primera etapa; el
+    rendimiento queda limitado por la etapa más lenta y no por la suma de
+    todas. depths() expone la profundidad de cada cola. Con `output`, la
+    última etapa entrega a la primera etapa de otro pipeline (varias cámaras
+    alimentando un mismo reconocimiento).
+    """
+
+    def __init__(self, stages, output=None):
+        self.stages = stages
+        for current, following in zip(stages, stages[1:]):
+            current.output = following
+        if output is not None:
+            stages[-1].output = output.stages[0]
+        self.stop_event = threading.Event()
+
+    def start(self):
+        self.stop_event.clear()
+        for stage in self.stages:
+            stage.thread = threading.Thread(target=stage.run, args=(self.stop_event,),
+                                            name=f"ebi-{stage.name}", daemon=True)
+            stage.thread.start()
+
+    def stop(self, timeout=2.0):
+        self.stop_event.set()
+        deadline = time.time() + timeout
+        for stage in self.stages:
+            if stage.thread and stage.thread.is_alive():
+                stage.thread.join(timeout=max(0.0, deadline - time.time()))
+
+    def ready(self, timeout=None):
+        """Espera a que la primera etapa quede libre; False si vence el tiempo"""
+        return self.stages[0].idle.wait(timeout)
+
+    def submit(self, item):
+        self.stages[0].idle.clear()
+        return self.stages[0].input.put(item, self.stop_event)
+
+    def depths(self):
+        """Profundidad actual de la cola de entrada de cada etapa"""
+        return {stage.name: stage.input.depth() for stage in self.stages}
+
+    def stats(self):
+        """Por etapa: profundidad, descartados, procesados y tiempo medio (ms)"""
+        return {
+            stage.name: {
+                'depth': stage.input.depth(),
+                'dropped': stage.input.dropped,
+                'processed': stage.processed,
+                'avg_ms': 1000.0 * stage.busy_time / stage.processed if stage.processed else 0.0,
+                'latency_ms': 1000.0 * stage.latency,
+            }
+            for stage in self.stages
+        }
+
+
+class DetectionScheduler:
+    """
+    Entrega frames al pipeline a medida que llegan de la cámara, sin sondeo:
+    espera un frame nuevo en el FrameRing y que la primera etapa esté libre.
+    Con actividad en escena (caras vistas hace menos de `active_hold`
+    segundos) detecta tan seguido como lo permite la latencia medida de la
+    etapa más lenta de detección; sin actividad baja a un frame cada
+    `idle_interval` segundos. Con `wake(frame)`, una prueba barata (p. ej.
+    movimiento) que se corre sobre cada frame nuevo mientras la escena está
+    vacía, el frame que la dispara se entrega enseguida y la escena pasa a
+    activa, así no se pierde a alguien que cruza entre dos frames en reposo.
+    """
+
+    def __init__(self, ring, pipeline, detection_stages=1, min_interval=0.0,
+                 idle_interval=2.0, active_hold=5.0, wake=None):
+        self.ring = ring
+        self.pipeline = pipeline
+        self.detection_stages = pipeline.stages[:detection_stages]
+        self.min_interval = min_interval
+        self.idle_interval = idle_interval
+        self.active_hold = active_hold
+        self.wake = wake
+        self.last_activity = 0.0
+
+    def notify_activity(self, count):
+        """Lo llama la detección con la cantidad de caras (o zonas con movimiento) encontradas"""
+        if count:
+            self.last_activity = time.time()
+
+    def active(self):
+        return time.time() - self.last_activity < self.active_hold
+
+    def interval(self):
+        """Tiempo mínimo entre dos frames entregados según actividad y latencia"""
+        if not self.active():
+            return self.idle_interval
+        return max(self.min_interval, max(stage.latency for stage in self.detection_stages))
+
+    def run(self, stop_event):
+        seq = -1
+        last_submit = 0.0
+        while not stop_event.is_set():
+            # No entregar un frame mientras el anterior sigue en la primera etapa
+            if not self.pipeline.ready(timeout=0.5):
+                continue
+            wait = last_submit + self.interval() - time.time()
+            if wait > 0 and (self.wake is None or self.active()):
+                # Esperar lo que falta, pero despertar si se pide detener
+                stop_event.wait(min(wait, 0.5))
+                continue
+            latest = self.ring.wait_newer(seq, timeout=min(wait, 0.5) if wait > 0 else 0.5)
+            if latest is None:
+                continue
+            seq, timestamp, frame = latest
+            if wait > 0:
+                # Escena vacía: solo la prueba barata, hasta que algo se mueva
+                if not self.wake(frame):
+                    continue
+                self.last_activity = time.time()
+            last_submit = time.time()
+            self.pipeline.submit({'seq': seq, 'timestamp': timestamp, 'frame': frame})
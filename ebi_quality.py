@@ -0,0 +1,109 @@
+# Control de calidad de las caras antes de calcular encodings
+import math
+import threading
+
+import cv2
+import face_recognition
+import numpy as np
+
+REJECT_REASONS = ('tamaño', 'nitidez', 'pose')
+
+
+def sharpness(gray, size=64):
+    """Varianza del Laplaciano del recorte llevado a `size` x `size` (independiente de la resolución)"""
+    patch = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(patch, cv2.CV_64F).var())
+
+
+def head_pose(landmarks):
+    """
+    Pose aproximada a partir de los 5 puntos de face_landmarks(model='small')
+    (o de ojos y base de la nariz del modelo de 68 puntos):
+    (giro lateral, cabeceo, inclinación en grados). El giro es cuánto se aparta
+    la nariz del punto medio entre los ojos a lo largo de la línea de los ojos
+    y el cabeceo cuánto baja la nariz respecto de esa línea, ambos relativos a
+    la distancia entre los ojos (de frente: giro ~0, cabeceo ~0.7).
+    """
+    left = np.mean(landmarks['left_eye'], axis=0)
+    right = np.mean(landmarks['right_eye'], axis=0)
+    nose = np.mean(landmarks['nose_tip'], axis=0)
+    axis = right - left
+    if axis[0] < 0:
+        axis = -axis  # de izquierda a derecha en la imagen, sea cual sea el orden de los ojos
+    eye_distance = max(1.0, float(np.hypot(*axis)))
+    axis /= eye_distance
+    offset = nose - (left + right) / 2.0
+    yaw = float(np.dot(offset, axis)) / eye_distance
+    pitch = float(axis[0] * offset[1] - axis[1] * offset[0]) / eye_distance
+    roll = math.degrees(math.atan2(axis[1], axis[0]))
+    return yaw, pitch, roll
+
+
+class FaceQualityGate:
+    """
+    Descarta caras que no vale la pena reconocer antes de pagar el encoding:
+    de menos de `min_size` píxeles de alto, borrosas (varianza del Laplaciano
+    menor a `min_sharpness`) o de perfil / muy inclinadas según los 5 puntos
+    de referencia. Los chequeos van del más barato al más caro y los landmarks
+    solo se calculan para las caras que pasaron los anteriores.
+    """
+
+    def __init__(self, min_size=40, min_sharpness=40.0, max_yaw=0.3, pitch_range=(0.3, 1.2),
+                 max_roll=30.0, check_pose=True):
+        self.min_size = min_size
+        self.min_sharpness = min_sharpness
+        self.max_yaw = max_yaw
+        self.pitch_range = pitch_range
+        self.max_roll = max_roll
+        self.check_pose = check_pose
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(('aceptadas',) + REJECT_REASONS, 0)
+
+    def reason(self, gray, box):
+        """Motivo de rechazo de una cara por tamaño o nitidez, o None si pasa"""
+        top, right, bottom, left = box
+        if min(bottom - top, right - left) < self.min_size:
+            return 'tamaño'
+        crop = gray[max(0, top):bottom, max(0, left):right]
+        if not crop.size or sharpness(crop) < self.min_sharpness:
+            return 'nitidez'
+        return None
+
+    def pose_ok(self, landmarks):
+        if not landmarks or not all(landmarks.get(k) for k in ('left_eye', 'right_eye', 'nose_tip')):
+            return False
+        yaw, pitch, roll = head_pose(landmarks)
+        return (abs(yaw) <= self.max_yaw and self.pitch_range[0] <= pitch <= self.pitch_range[1]
+                and abs(roll) <= self.max_roll)
+
+    def filter(self, frame, boxes, landmarks=None):
+        """
+        Lista alineada con `boxes` (frame BGR) con True para las caras que
+        merecen encoding; cuenta los rechazos por motivo. Si quien llama ya
+        tiene los landmarks de esas cajas (`landmarks`, None donde no hubo)
+        se usan para la pose en lugar de calcularlos.
+        """
+        if not boxes:
+            return []
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        reasons = [self.reason(gray, box) for box in boxes]
+
+        candidates = [i for i, reason in enumerate(reasons) if reason is None]
+        if self.check_pose and candidates:
+            if landmarks is None:
+                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                found = face_recognition.face_landmarks(rgb, [boxes[i] for i in candidates], model='small')
+            else:
+                found = [landmarks[i] for i in candidates]
+            for i, points in zip(candidates, found):
+                if not self.pose_ok(points):
+                    reasons[i] = 'pose'
+
+        with self.lock:
+            for reason in reasons:
+                self.counts[reason or 'aceptadas'] += 1
+        return [reason is None for reason in reasons]
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
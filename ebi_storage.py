@@ -0,0 +1,390 @@
+# Bases de datos de EBI: creación/migración de tablas y carga de la galería
+import logging
+import os
+import pickle
+import queue
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from ebi_gallery import ENCODING_SIZE, decode_encoding
+
+# Columnas de detecciones agregadas después de la primera versión de la tabla
+DETECTION_COLUMNS = (
+    ('autorizado', 'INTEGER'),
+    ('ubicacion', "TEXT DEFAULT 'Desconocida'"),
+    ('archivo_origen', 'TEXT'),  # Video del que salió la detección (escaneo de grabaciones)
+    ('tiempo_video', 'REAL'),  # Segundos desde el inicio del video
+    ('vivacidad', 'TEXT'),  # Prueba de vida del track: vivo, sospechoso o indeterminado
+    ('vivacidad_puntaje', 'REAL'),
+)
+
+# Datos con los que se guarda una cara que no coincide con nadie de la galería
+UNKNOWN_PERSON = {
+    'id': -1,
+    'nombre': 'DESCONOCIDO',
+    'dni': 'N/A',
+    'desc': 'Persona no registrada en el sistema',
+    'autorizado': 0
+}
+
+
+# Crear la base de datos de personas (autorizadas e intrusos)
+def create_database(db_file):
+    try:
+        conn = sqlite3.connect(db_file)
+        c = conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS personas
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     nombre TEXT,
+                     dni TEXT,
+                     descripcion TEXT,
+                     autorizado INTEGER DEFAULT 0,
+                     foto_blob BLOB NOT NULL,
+                     encoding BLOB NOT NULL,
+                     fecha_carga TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        
+        # Verificar si la columna 'encoding_format' existe (bases anteriores son float64)
+        c.execute("PRAGMA table_info(personas)")
+        columns = [column[1] for column in c.fetchall()]
+        if 'encoding_format' not in columns:
+            c.execute("ALTER TABLE personas ADD COLUMN encoding_format TEXT DEFAULT 'float64'")
+        
+        # Plantillas adicionales de cada persona (la primera es personas.encoding)
+        c.execute('''CREATE TABLE IF NOT EXISTS persona_templates
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     persona_id INTEGER NOT NULL,
+                     encoding BLOB NOT NULL,
+                     encoding_format TEXT DEFAULT 'float64',
+                     fecha_carga TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     FOREIGN KEY (persona_id) REFERENCES personas (id))''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_persona_templates_persona ON persona_templates (persona_id)")
+        
+        # Versión de la tabla personas: la incrementan triggers en cada cambio
+        # de encodings y permite saber si la caché de encodings está vigente
+        c.execute('''CREATE TABLE IF NOT EXISTS personas_version
+                     (version INTEGER NOT NULL)''')
+        c.execute("INSERT INTO personas_version (version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM personas_version)")
+        for name, event in (('insert', 'INSERT'), ('update', 'UPDATE OF encoding'), ('delete', 'DELETE')):
+            c.execute(f'''CREATE TRIGGER IF NOT EXISTS personas_version_{name}
+                         AFTER {event} ON personas
+                         BEGIN UPDATE personas_version SET version = version + 1; END''')
+        conn.commit()
+        conn.close()
+        logging.info("Base de datos de personas creada/verificada correctamente")
+    except Exception as e:
+        logging.error(f"Error al crear la base de datos de personas: {e}")
+
+# Crear la base de datos de detecciones
+def create_detections_database(db_file):
+    try:
+        conn = sqlite3.connect(db_file)
+        c = conn.cursor()
+        
+        # Primero, verificar si la tabla existe
+        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='detecciones'")
+        table_exists = c.fetchone()
+        
+        if table_exists:
+            # Agregar las columnas que no existían en versiones anteriores
+            c.execute("PRAGMA table_info(detecciones)")
+            columns = [column[1] for column in c.fetchall()]
+            for name, declaration in DETECTION_COLUMNS:
+                if name not in columns:
+                    c.execute(f"ALTER TABLE detecciones ADD COLUMN {name} {declaration}")
+        else:
+            # Crear la tabla si no existe
+            c.execute('''CREATE TABLE IF NOT EXISTS detecciones
+                         (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                         persona_id INTEGER,
+                         nombre TEXT,
+                         dni TEXT,
+                         autorizado INTEGER,
+                         fecha_deteccion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                         foto_blob BLOB,
+                         ubicacion TEXT DEFAULT 'Desconocida',
+                         archivo_origen TEXT,
+                         tiempo_video REAL,
+                         vivacidad TEXT,
+                         vivacidad_puntaje REAL,
+                         FOREIGN KEY (persona_id) REFERENCES personas (id))''')
+        
+        conn.commit()
+        conn.close()
+        logging.info("Base de datos de detecciones creada/verificada correctamente")
+    except Exception as e:
+        logging.error(f"Error al crear la base de datos de detecciones: {e}")
+
+
+def load_gallery(db_file, gallery, encoding_cache, ann_index_file=None, ann_min_gallery=100000):
+    """
+    Carga en `gallery` las personas de la base con sus plantillas (False si falla). Los
+    encodings se toman de la caché .npy si sigue vigente para la versión de
+    la tabla. Con galerías grandes se activa el índice aproximado.
+    """
+    try:
+        conn = sqlite3.connect(db_file)
+        c = conn.cursor()
+        c.execute("SELECT version FROM personas_version")
+        version = c.fetchone()[0]
+        c.execute("SELECT id, nombre, dni, descripcion, autorizado FROM personas ORDER BY id")
+        rows = c.fetchall()
+        
+        ids = []
+        face_data = []
+        
+        for row in rows:
+            id_val, nombre, dni, desc, autorizado = row
+            ids.append(id_val)
+            face_data.append({
+                'id': id_val,
+                'nombre': nombre,
+                'dni': dni,
+                'desc': desc,
+                'autorizado': autorizado
+            })
+        
+        # Abrir la caché de encodings mapeada en memoria; solo si está
+        # desactualizada se deserializan los BLOB de la base
+        sq_norms = None
+        cached = encoding_cache.load(version, ids)
+        if cached is None:
+            logging.info("Caché de encodings desactualizada, se reconstruye desde la base")
+            c.execute("SELECT id, encoding, encoding_format FROM personas ORDER BY id")
+            encodings = np.empty((len(ids), ENCODING_SIZE), dtype=np.float32)
+            for i, (id_val, encoding_blob, encoding_format) in enumerate(c):
+                encodings[i] = decode_encoding(encoding_blob, encoding_format)
+            encoding_cache.save(ids, encodings, version)
+            # Volver a abrirla mapeada para no retener la copia en memoria
+            cached = encoding_cache.load(version, ids)
+        if cached is not None:
+            encodings, sq_norms = cached
+        
+        # Plantillas adicionales: cada persona con más de una se compara
+        # por centroide y luego por la más cercana de sus plantillas
+        templates = {}
+        c.execute("SELECT persona_id, encoding, encoding_format FROM persona_templates ORDER BY id")
+        for persona_id, encoding_blob, encoding_format in c:
+            templates.setdefault(persona_id, []).append(decode_encoding(encoding_blob, encoding_format))
+        row_of = {id_val: i for i, id_val in enumerate(ids)}
+        for persona_id in list(templates):
+            if persona_id not in row_of:
+                del templates[persona_id]  # plantillas de personas borradas
+                continue
+            templates[persona_id].insert(0, np.asarray(encodings[row_of[persona_id]]))
+        
+        conn.close()
+        gallery.load(encodings, face_data, templates, sq_norms)
+        logging.info(f"Personas cargadas: {len(gallery)}")
+        
+        # Con galerías muy grandes, usar el índice aproximado (se carga o se construye)
+        if len(gallery) >= ann_min_gallery:
+            gallery.enable_index(ann_index_file)
+        return True
+    except Exception as e:
+        logging.error(f"Error al cargar personas: {e}")
+        return False
+
+
+class DetectionWriter:
+    """
+    Único escritor de la tabla detecciones: un hilo con una conexión abierta
+    todo el tiempo (modo WAL, para que la interfaz pueda leer mientras se
+    escribe) que toma filas de una cola y las inserta con executemany en una
+    sola transacción. Un lote se cierra al juntar `batch_size` filas o cuando
+    la primera lleva `max_delay` segundos esperando; así quien detecta no
+    espera el fsync de cada fila. Si la base no se puede abrir o una escritura
+    falla, el hilo reintenta la conexión con espera creciente. Ninguna fila se
+    descarta: las que no llegan a la base quedan en `spill_file` y se escriben
+    en cuanto vuelve a haber conexión.
+    """
+
+    def __init__(self, db_file, columns, batch_size=32, max_delay=0.5, maxsize=1024, max_backoff=30.0,
+                 spill_file=None):
+        self.db_file = db_file
+        self.insert = (f"INSERT INTO detecciones ({', '.join(columns)}) "
+                       f"VALUES ({', '.join('?' for _ in columns)})")
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_backoff = max_backoff
+        self.spill_file = spill_file or f"{db_file}.pendientes"
+        self.spill_lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.connected = False
+        self.spilled = 0  # filas que pasaron por el archivo de pendientes
+        self.failed = 0  # filas que no se pudieron guardar ni en la base ni en disco
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, row, stop_event=None):
+        """
+        Encola una fila (tupla en el orden de `columns`). Con la cola llena
+        espera (contrapresión) mientras el escritor tenga la base abierta; si
+        el escritor no corre, perdió la conexión o se pidió detener
+        (`stop_event`), la fila va al archivo de pendientes.
+        """
+        while self.thread is not None and self.thread.is_alive():
+            # Sin conexión la cola no se vacía pronto: no frenar la detección
+            wait = self.connected and not (stop_event is not None and stop_event.is_set())
+            try:
+                self.queue.put(row, block=wait, timeout=0.1)
+                return True
+            except queue.Full:
+                if not wait:
+                    break
+        return self.spill([row])
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def next_batch(self):
+        """Filas del próximo lote, o [] si no llegó ninguna (para revisar si hay que detenerse)"""
+        try:
+            batch = [self.queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.time() + self.max_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def drain(self):
+        """Saca de la cola todo lo que quedó"""
+        rows = []
+        while True:
+            try:
+                rows.append(self.queue.get_nowait())
+            except queue.Empty:
+                return rows
+
+    def spill(self, rows):
+        """Agrega filas al archivo de pendientes; False si tampoco se pudo guardar ahí"""
+        try:
+            with self.spill_lock, open(self.spill_file, 'ab') as f:
+                pickle.dump(list(rows), f)
+            self.spilled += len(rows)
+            logging.warning(f"{len(rows)} detecciones guardadas en {self.spill_file} "
+                            f"hasta poder escribirlas en la base")
+            return True
+        except Exception as e:
+            self.failed += len(rows)
+            logging.error(f"Error al guardar {len(rows)} detecciones pendientes: {e}")
+            return False
+
+    def restore(self, conn):
+        """Escribe en la base las filas del archivo de pendientes, si hay"""
+        rows = []
+        with self.spill_lock:
+            if not os.path.exists(self.spill_file):
+                return
+            try:
+                with open(self.spill_file, 'rb') as f:
+                    while True:
+                        try:
+                            rows.extend(pickle.load(f))
+                        except EOFError:
+                            break
+                        except Exception as e:
+                            # Un corte a mitad de una escritura deja el final incompleto
+                            logging.error(f"Error al leer {self.spill_file}, se recupera lo anterior: {e}")
+                            break
+                os.remove(self.spill_file)
+            except Exception as e:
+                logging.error(f"Error al abrir las detecciones pendientes: {e}")
+                return
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            if not self.write(conn, batch):
+                self.spill(batch)
+        logging.info(f"Detecciones pendientes recuperadas: {len(rows)}")
+
+    def connect(self):
+        """Conexión del escritor, o None si la base no se pudo abrir"""
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_file)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # En WAL, NORMAL no hace fsync en cada commit (sí en los checkpoints)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            return conn
+        except Exception as e:
+            logging.error(f"Error al abrir la base de detecciones: {e}")
+            if conn is not None:
+                conn.close()
+            return None
+
+    def write(self, conn, batch):
+        """Inserta el lote en una transacción; False si falló"""
+        try:
+            with conn:
+                conn.executemany(self.insert, batch)
+            return True
+        except Exception as e:
+            logging.error(f"Error al guardar {len(batch)} detecciones: {e}")
+            return False
+
+    def run(self):
+        conn = None
+        batch = []
+        backoff = 1.0
+        try:
+            # Al detener se termina de vaciar la cola antes de cerrar
+            while not self.stop_event.is_set() or batch or not self.queue.empty():
+                if conn is None:
+                    conn = self.connect()
+                    if conn is None:
+                        # Las filas esperan en la cola mientras se reintenta
+                        if self.stop_event.wait(backoff):
+                            break
+                        backoff = min(backoff * 2, self.max_backoff)
+                        continue
+                    backoff = 1.0
+                    self.connected = True
+                    self.restore(conn)
+                if not batch:
+                    batch = self.next_batch()
+                if not batch or self.write(conn, batch):
+                    batch = []
+                    continue
+                # Falló la escritura: reabrir la conexión y reintentar el lote
+                # una vez; si vuelve a fallar (p. ej. disco lleno) va a pendientes
+                conn.close()
+                conn = self.connect()
+                self.connected = conn is not None
+                if conn is None or not self.write(conn, batch):
+                    self.spill(batch)
+                batch = []
+        finally:
+            self.connected = False
+            if conn is not None:
+                conn.close()
+            rows = batch + self.drain()
+            if rows:
+                self.spill(rows)
+
+    def stop(self, timeout=5.0):
+        """Escribe lo pendiente y cierra la conexión"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                logging.warning(f"El escritor de detecciones no terminó: {self.pending()} filas sin guardar")
+            else:
+                # Filas encoladas mientras el hilo terminaba
+                rows = self.drain()
+                if rows:
+                    self.spill(rows)
+            self.thread = None
@@ -0,0 +1,218 @@
+# Seguimiento de rostros entre detecciones para no recalcular encodings de la misma cara
+import itertools
+import threading
+from collections import Counter, deque
+
+import numpy as np
+
+
+def box_to_state(box):
+    """(top, right, bottom, left) de face_recognition -> [cx, cy, ancho, alto]"""
+    top, right, bottom, left = box
+    return np.array([(left + right) / 2.0, (top + bottom) / 2.0, right - left, bottom - top], dtype=np.float64)
+
+
+def state_to_box(state):
+    cx, cy, w, h = state
+    return (int(round(cy - h / 2)), int(round(cx + w / 2)), int(round(cy + h / 2)), int(round(cx - w / 2)))
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """IoU entre cada par de cajas (top, right, bottom, left)"""
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    top = np.maximum(a[:, None, 0], b[None, :, 0])
+    right = np.minimum(a[:, None, 1], b[None, :, 1])
+    bottom = np.minimum(a[:, None, 2], b[None, :, 2])
+    left = np.maximum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    area_a = (a[:, 1] - a[:, 3]) * (a[:, 2] - a[:, 0])
+    area_b = (b[:, 1] - b[:, 3]) * (b[:, 2] - b[:, 0])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+
+class Track:
+    """
+    Una cara seguida entre detecciones. La posición se predice con un filtro
+    alfa-beta (Kalman de velocidad constante simplificado) sobre centro y
+    tamaño. La identidad reconocida queda asociada al track.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, box, timestamp):
+        self.id = next(self._ids)
+        self.state = box_to_state(box)
+        self.velocity = np.zeros(4, dtype=np.float64)
+        self.timestamp = timestamp
+        self.box = tuple(box)
+        self.hits = 1
+        self.misses = 0
+        self.frames_since_encoding = None  # None: todavía sin encoding
+        self.identity = None  # face_data confirmado (o desconocido) del track
+        self.distance = None
+        self.reported_id = None  # id de la identidad ya guardada/alertada
+        self.votes = deque()  # últimos reconocimientos: (persona_id, face_data, distancia)
+        self.voting = True  # sin identidad confirmada (o en disputa): codificar en cada detección
+        self.liveness = None  # prueba de vida continua del track (ebi_liveness.TrackLiveness)
+        self.pending_identity = None  # identidad confirmada que espera la prueba de vida para registrarse
+        self.pending_frame = None  # frame en que se confirmó pending_identity (evidencia si el track se cierra)
+
+    def predict(self, timestamp):
+        """Caja esperada en `timestamp` según la velocidad estimada"""
+        dt = max(0.0, timestamp - self.timestamp)
+        return state_to_box(self.state + self.velocity * dt)
+
+    def correct(self, box, timestamp, alpha=0.6, beta=0.2):
+        dt = max(1e-3, timestamp - self.timestamp)
+        predicted = self.state + self.velocity * dt
+        residual = box_to_state(box) - predicted
+        self.state = predicted + alpha * residual
+        self.velocity = self.velocity + (beta / dt) * residual
+        self.timestamp = timestamp
+        self.box = tuple(box)
+        self.hits += 1
+        self.misses = 0
+
+
+class FaceTracker:
+    """
+    Asocia las cajas de cada detección con los tracks existentes (por IoU con
+    la caja predicha y, si no se solapan, por distancia entre centros) y decide
+    qué caras necesitan un encoding: los tracks que todavía están votando su
+    identidad y, cada `reverify_every` detecciones, los ya confirmados para
+    re-verificarla.
+    """
+
+    def __init__(self, iou_threshold=0.3, center_threshold=0.5, max_misses=3, reverify_every=10):
+        self.iou_threshold = iou_threshold
+        self.center_threshold = center_threshold  # fracción de la diagonal de la caja
+        self.max_misses = max_misses
+        self.reverify_every = reverify_every
+        self.tracks = []
+        self.abandoned = []  # tracks cerrados con una identidad pendiente de registrar
+        self.lock = threading.Lock()
+
+    def update(self, boxes, timestamp):
+        """
+        Actualiza los tracks con las cajas detectadas en `timestamp`.
+        Devuelve una lista alineada con `boxes` de (track, necesita_encoding).
+        """
+        with self.lock:
+            boxes = [tuple(int(v) for v in box) for box in boxes]
+            assigned = [None] * len(boxes)
+            free_tracks = list(range(len(self.tracks)))
+
+            if self.tracks and boxes:
+                predicted = [t.predict(timestamp) for t in self.tracks]
+                iou = iou_matrix(predicted, boxes)
+                # Para cajas que casi no se solapan, usar la cercanía de los centros
+                centers_t = np.array([box_to_state(p)[:2] for p in predicted])
+                states_b = np.array([box_to_state(b) for b in boxes])
+                dist = np.linalg.norm(centers_t[:, None, :] - states_b[None, :, :2], axis=2)
+                diag = np.maximum(np.hypot(states_b[:, 2], states_b[:, 3]), 1.0)[None, :]
+                near = dist < self.center_threshold * diag
+                scores = np.where(iou >= self.iou_threshold, iou,
+                                  np.where(near, self.iou_threshold * (1 - dist / diag), -1.0))
+
+                # Asociación voraz: primero los pares con mayor puntaje
+                for flat in np.argsort(-scores, axis=None):
+                    t, b = divmod(int(flat), len(boxes))
+                    if scores[t, b] < 0:
+                        break
+                    if assigned[b] is not None or t not in free_tracks:
+                        continue
+                    assigned[b] = self.tracks[t]
+                    free_tracks.remove(t)
+
+            # Tracks no vistos en esta detección
+            for t in free_tracks:
+                self.tracks[t].misses += 1
+            self.abandoned.extend(t for t in self.tracks
+                                  if t.misses > self.max_misses and t.pending_identity is not None)
+            self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+
+            results = []
+            for b, box in enumerate(boxes):
+                track = assigned[b]
+                if track is None:
+                    track = Track(box, timestamp)
+                    self.tracks.append(track)
+                else:
+                    track.correct(box, timestamp)
+                needs_encoding = (track.frames_since_encoding is None or track.voting
+                                  or track.frames_since_encoding + 1 >= self.reverify_every)
+                if needs_encoding:
+                    track.frames_since_encoding = 0
+                else:
+                    track.frames_since_encoding += 1
+                results.append((track, needs_encoding))
+            return results
+
+    def predicted_boxes(self, timestamp):
+        """Cajas donde se espera ver cada track abierto en `timestamp`"""
+        with self.lock:
+            return [track.predict(timestamp) for track in self.tracks]
+
+    def retry(self, track):
+        """La cara del track no se pudo codificar (p. ej. de mala calidad): pedir encoding otra vez"""
+        with self.lock:
+            track.frames_since_encoding = None
+
+    def take_abandoned(self):
+        """Devuelve (y olvida) los tracks cerrados que tenían una identidad pendiente de registrar"""
+        with self.lock:
+            abandoned, self.abandoned = self.abandoned, []
+            return abandoned
+
+    def forget_identities(self, is_known):
+        """Obliga a re-verificar los tracks cuya persona ya no cumple is_known(persona_id)"""
+        with self.lock:
+            for track in self.tracks:
+                identity = track.identity
+                if identity is not None and identity['id'] != -1 and not is_known(identity['id']):
+                    track.identity = None
+                    track.pending_identity = None
+                    track.pending_frame = None
+                    track.frames_since_encoding = None
+                    track.votes.clear()
+                    track.voting = True
+
+    def clear(self):
+        with self.lock:
+            self.tracks = []
+            self.abandoned = []
+
+
+class IdentityVoter:
+    """
+    Confirma la identidad de un track solo cuando k de sus últimos n
+    reconocimientos coinciden, para que un frame ruidoso no guarde una
+    detección ni dispare una alarma. `policies` da (k, n) según la clase
+    'autorizado' del candidato: con {0: (2, 3), 1: (3, 5)} un intruso o
+    desconocido se confirma con 2 de 3 frames y un autorizado con 3 de 5.
+    """
+
+    def __init__(self, policies=None):
+        self.policies = policies or {0: (2, 3), 1: (3, 5)}
+        self.window = max(n for _, n in self.policies.values())
+
+    def vote(self, votes, face_data, distance):
+        """
+        Agrega un reconocimiento a `votes` (deque del track) y devuelve
+        (face_data, distancia media) de la identidad confirmada, o None si
+        ninguna alcanza todavía su k de n.
+        """
+        votes.append((face_data['id'], face_data, distance))
+        while len(votes) > self.window:
+            votes.popleft()
+
+        best = None
+        for persona_id in Counter(v[0] for v in votes):
+            data = next(v[1] for v in reversed(votes) if v[0] == persona_id)
+            k, n = self.policies.get(int(bool(data['autorizado'])), (1, 1))
+            agreeing = [v[2] for v in list(votes)[-n:] if v[0] == persona_id]
+            if len(agreeing) >= k and (best is None or len(agreeing) > best[2]):
+                best = (data, sum(agreeing) / len(agreeing), len(agreeing))
+        return best[:2] if best else None
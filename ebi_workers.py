@@ -0,0 +1,176 @@
+# Detección y encodings de rostros en un pool de procesos con memoria compartida
+import logging
+import multiprocessing
+import queue
+from multiprocessing import shared_memory
+
+import cv2
+import face_recognition
+import numpy as np
+
+from ebi_detectors import create_detector, scale_boxes
+
+# En cada proceso del pool: (nombre, bloque de memoria compartida) abierto para cada slot
+_attached = {}
+# En cada proceso del pool: detectores ya creados, por backend y opciones
+_detectors = {}
+
+
+def _attach(slot, name):
+    attached = _attached.get(slot)
+    if attached is not None and attached[0] == name:
+        return attached[1]
+    if attached is not None:
+        # El slot se agrandó: el bloque viejo ya fue desvinculado por el
+        # proceso principal y solo se libera cuando todos lo cierran
+        try:
+            attached[1].close()
+        except Exception as e:
+            logging.error(f"Error al cerrar memoria compartida: {e}")
+    try:
+        # Python 3.13+: el proceso principal es el dueño del bloque
+        block = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        block = shared_memory.SharedMemory(name=name)
+    _attached[slot] = (name, block)
+    return block
+
+
+def _image(slot, name, shape):
+    return np.ndarray(shape, dtype=np.uint8, buffer=_attach(slot, name).buf)
+
+
+def locate_faces(slot, name, shape, backend='hog', options=None, scale=1.0):
+    """
+    En el worker: localizar caras en la imagen RGB del bloque `name` con el
+    detector `backend`, sobre una copia reducida a `scale`; las cajas se
+    devuelven en coordenadas de la imagen completa.
+    """
+    key = (backend, tuple(sorted((options or {}).items())))
+    detector = _detectors.get(key)
+    if detector is None:
+        detector = _detectors[key] = create_detector(backend, options)
+    image = _image(slot, name, shape)
+    if scale == 1.0:
+        return detector.locate(image)
+    small = cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return scale_boxes(detector.locate(small), 1.0 / scale, shape)
+
+
+def encode_faces(slot, name, shape, boxes):
+    """En el worker: encodings de las caras `boxes` de la imagen del bloque `name`"""
+    return face_recognition.face_encodings(_image(slot, name, shape), boxes)
+
+
+class SharedFrames:
+    """
+    Bloques de memoria compartida reutilizables para pasar imágenes a los
+    workers sin serializarlas. Cada bloque se toma con acquire() y se devuelve
+    con release(); si no hay bloques libres el que pide espera (contrapresión).
+    """
+
+    def __init__(self, slots, nbytes):
+        self.blocks = [shared_memory.SharedMemory(create=True, size=max(1, nbytes)) for _ in range(slots)]
+        self.free = queue.Queue()
+        for index in range(slots):
+            self.free.put(index)
+
+    def acquire(self, timeout=None):
+        try:
+            return self.free.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def write(self, index, image):
+        """Copia `image` al bloque (agrandándolo si hace falta) y devuelve su nombre"""
+        block = self.blocks[index]
+        if block.size < image.nbytes:
+            block.close()
+            block.unlink()
+            block = self.blocks[index] = shared_memory.SharedMemory(create=True, size=image.nbytes)
+        np.copyto(np.ndarray(image.shape, dtype=np.uint8, buffer=block.buf), image)
+        return block.name
+
+    def release(self, index):
+        self.free.put(index)
+
+    def close(self):
+        for block in self.blocks:
+            try:
+                block.close()
+                block.unlink()
+            except Exception as e:
+                logging.error(f"Error al liberar memoria compartida: {e}")
+        self.blocks = []
+
+
+class FrameJob:
+    """Un frame enviado al pool: localización en curso y encodings a pedido"""
+
+    def __init__(self, pool, index, name, shape, result):
+        self.pool = pool
+        self.index = index
+        self.slot = index  # index vuelve a None al liberar el bloque
+        self.name = name
+        self.shape = shape
+        self.result = result
+
+    def locations(self, timeout=None):
+        return self.result.get(timeout)
+
+    def encode(self, boxes):
+        """Encodings de `boxes`, repartidos entre los workers y en el mismo orden"""
+        if not boxes:
+            return []
+        chunks = np.array_split(np.arange(len(boxes)), min(len(boxes), self.pool.processes))
+        results = [self.pool.pool.apply_async(encode_faces,
+                                              (self.slot, self.name, self.shape, [boxes[i] for i in chunk]))
+                   for chunk in chunks]
+        encodings = []
+        for result in results:
+            encodings.extend(result.get())
+        return encodings
+
+    def release(self):
+        if self.index is not None:
+            self.pool.frames.release(self.index)
+            self.index = None
+
+
+class EncodingPool:
+    """
+    Pool de procesos para face_locations/face_encodings. locate() copia la
+    imagen a memoria compartida y devuelve enseguida un FrameJob, así varios
+    frames se procesan en paralelo; quien los recoge en el orden en que se
+    enviaron obtiene los resultados en orden de captura.
+    """
+
+    def __init__(self, processes, nbytes=640 * 480 * 3, slots=None):
+        self.processes = max(1, processes)
+        # Un bloque por frame en vuelo: uno por worker más margen para el que se recoge
+        self.frames = SharedFrames(slots or self.processes + 2, nbytes)
+        # 'spawn' evita heredar los hilos de la interfaz y de la cámara
+        self.pool = multiprocessing.get_context('spawn').Pool(self.processes)
+
+    def locate(self, image, backend='hog', options=None, scale=1.0, timeout=None):
+        """
+        Envía una imagen RGB uint8 a localizar (reducida a `scale` en el worker;
+        los encodings se calculan sobre la imagen completa). None si no hubo
+        bloque libre a tiempo.
+        """
+        index = self.frames.acquire(timeout)
+        if index is None:
+            return None
+        try:
+            image = np.ascontiguousarray(image, dtype=np.uint8)
+            name = self.frames.write(index, image)
+            result = self.pool.apply_async(locate_faces, (index, name, image.shape, backend, options, scale))
+        except Exception:
+            self.frames.release(index)
+            raise
+        return FrameJob(self, index, name, image.shape, result)
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+        self.frames.close()
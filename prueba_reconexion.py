@@ -0,0 +1,154 @@
+# Prueba de reconexión de cámaras IP contra un stream local de reemplazo
+#
+# Uso: py prueba_reconexion.py --duracion 30 --cortar-cada 6 --caida 3
+#
+# Levanta en 127.0.0.1 un servidor MJPEG por HTTP que corta la conexión cada
+# `--cortar-cada` segundos y rechaza conexiones durante `--caida` segundos,
+# como una cámara IP que se reinicia. Un CameraReader lee esa URL (el mismo
+# camino que una cámara RTSP/HTTP del registro) y se mide si vuelve a
+# entregar frames después de cada corte y cuánto tarda. Al final se lo
+# detiene en medio de una reconexión para comprobar que el hilo de captura
+# termina y no queda ninguna captura abierta.
+import argparse
+import logging
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from ebi_capture import CameraReader
+
+BOUNDARY = 'frame'
+
+
+class StandInStream:
+    """Servidor MJPEG local que se cae a propósito cada tanto"""
+
+    def __init__(self, port=0, cut_every=6.0, downtime=3.0, fps=15, size=(320, 240)):
+        self.cut_every = cut_every
+        self.downtime = downtime
+        self.fps = fps
+        self.size = size
+        self.down_until = 0.0
+        self.connections = 0
+        self.rejected = 0
+        stream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stream.serve(self)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/video.mjpg"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def frame(self, number):
+        width, height = self.size
+        image = np.full((height, width, 3), (number * 7) % 255, dtype=np.uint8)
+        cv2.putText(image, str(number), (10, height // 2), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (255, 255, 255), 2)
+        return cv2.imencode('.jpg', image)[1].tobytes()
+
+    def serve(self, handler):
+        if time.time() < self.down_until:
+            # "Reiniciando": la apertura de la captura falla
+            self.rejected += 1
+            handler.send_error(503)
+            return
+        self.connections += 1
+        handler.send_response(200)
+        handler.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={BOUNDARY}')
+        handler.end_headers()
+        connected = time.time()
+        number = 0
+        try:
+            while time.time() - connected < self.cut_every:
+                jpeg = self.frame(number)
+                handler.wfile.write(f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                                    f"Content-Length: {len(jpeg)}\r\n\r\n".encode('ascii'))
+                handler.wfile.write(jpeg + b"\r\n")
+                number += 1
+                time.sleep(1.0 / self.fps)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        # Corte: se cierra la conexión y la "cámara" queda caída un rato
+        self.down_until = time.time() + self.downtime
+
+
+def watch(reader, duration):
+    """Muestrea el FrameRing y devuelve (frames recibidos, huecos sin frames en segundos)"""
+    gaps = []
+    last_seq, last_change = reader.ring.seq, time.time()
+    end = time.time() + duration
+    while time.time() < end:
+        time.sleep(0.05)
+        seq = reader.ring.seq
+        now = time.time()
+        if seq != last_seq:
+            if now - last_change > 0.5:
+                gaps.append(now - last_change)
+            last_seq, last_change = seq, now
+    return reader.ring.seq + 1, gaps, time.time() - last_change
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de reconexión de CameraReader contra un stream local")
+    parser.add_argument('--duracion', type=float, default=30.0)
+    parser.add_argument('--cortar-cada', type=float, default=6.0, help="segundos de stream antes de cada corte")
+    parser.add_argument('--caida', type=float, default=3.0, help="segundos que la cámara rechaza conexiones")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    stream = StandInStream(cut_every=args.cortar_cada, downtime=args.caida)
+    stream.start()
+    reader = CameraReader(stream.url, width=320, height=240)
+    if not reader.start():
+        stream.stop()
+        raise SystemExit(f"No se pudo abrir {stream.url} (¿OpenCV sin soporte de streams?)")
+
+    frames, gaps, stale = watch(reader, args.duracion)
+    ok = True
+    logging.info(f"{frames} frames, {stream.connections} conexiones, {stream.rejected} rechazadas")
+    logging.info("Cortes: " + (", ".join(f"{gap:.1f}s" for gap in gaps) or "ninguno"))
+    if stream.connections < 2:
+        logging.error("El lector no volvió a conectarse después del primer corte")
+        ok = False
+    if stale > args.caida + 5.0:
+        logging.error(f"Sin frames hace {stale:.1f}s al terminar: la reconexión no se recuperó")
+        ok = False
+
+    # Detener en medio de una reconexión: con la cámara caída el hilo está
+    # esperando para reabrir y la captura que abra no debe quedar viva
+    stream.down_until = time.time() + 60.0
+    time.sleep(1.0)
+    thread = reader.thread
+    started = time.time()
+    reader.stop()
+    if thread is not None:
+        thread.join(timeout=5.0)
+        if thread.is_alive():
+            logging.error("El hilo de captura no terminó después de stop()")
+            ok = False
+        else:
+            logging.info(f"Hilo de captura terminado {time.time() - started:.1f}s después de stop()")
+    stream.stop()
+
+    logging.info("Reconexión OK" if ok else "Reconexión con errores")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()